@@ -0,0 +1,71 @@
+import argparse
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+import matrix_io
+from matrix_io import parse_table, read_columns, load_cached, table_from_columns
+
+# ===========
+
+def write_flat(path, nbins, rng):
+    """ Write a synthetic flattened plot.*.dat file with nbins bins """
+
+    edges = np.linspace(0., 6500., nbins + 1)
+    values = rng.random((nbins + 1, 6))
+    values[-1] = values[-2]
+
+    np.savetxt(path, np.column_stack([edges, values]), fmt='%16.8g')
+
+def write_run(path, nbins, rng):
+    """ Write a synthetic run-directory distribution file with nbins bins """
+
+    edges = np.linspace(0., 6500., nbins + 1)
+    values = rng.random((nbins, 6))
+    rel = rng.random((nbins, 2)) * 30.
+
+    with open(path, 'w') as f:
+        f.write("#  left-edge  right-edge       scale-central  central-error        scale-min      min-error        scale-max      max-error      rel-down     rel-up\n")
+        for low, high, row, (down, up) in zip(edges[:-1], edges[1:], values, rel):
+            f.write(f"{low:12g}{high:12g}" + "".join(f"{v:17.8g}" for v in row) + f"{-down:12.2f}%{up:10.2f}%\n")
+
+# ===========
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare np.genfromtxt with matrix_io.parse_table and its binary cache on large MATRIX files")
+    parser.add_argument("--nbins", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        matrix_io.set_cache_dir(os.path.join(tmpdir, "cache"))
+
+        for nbins in args.nbins:
+
+            flat = os.path.join(tmpdir, f"plot.flat_{nbins}..NNLO.QCD.dat")
+            run = os.path.join(tmpdir, f"run_{nbins}__NNLO_QCD.dat")
+            write_flat(flat, nbins, rng)
+            write_run(run, nbins, rng)
+
+            for label, path, usecols in [
+                ("flat", flat, (0,1,2,3,4,5,6)),
+                ("run", run, (0,1,2,3,4,5,6,7)),
+                ]:
+
+                t_old = min(timeit.repeat(lambda: np.genfromtxt(path, usecols=usecols), number=1, repeat=args.repeat))
+                t_new = min(timeit.repeat(lambda: parse_table(path), number=1, repeat=args.repeat))
+
+                # first call fills the binary cache, the timed ones memory-map it
+                load_cached(path, read_columns)
+                t_warm = min(timeit.repeat(lambda: table_from_columns(load_cached(path, read_columns)), number=1, repeat=args.repeat))
+
+                print(f"{label:>4} {nbins:>8} bins: genfromtxt {t_old * 1e3:9.2f} ms, parse_table {t_new * 1e3:9.2f} ms (x{t_old / t_new:.1f}),"
+                      f" warm cache {t_warm * 1e3:7.3f} ms (x{t_old / t_warm:.0f})")
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,28 @@
 # Authors: CMS, Andrea Malara          #
 ########################################
 
-import ROOT as rt  # type: ignore
+import os
 from array import array
+from collections.abc import Mapping
+from functools import lru_cache
 from typing import List
 
-rt.gROOT.SetBatch(rt.kTRUE)
+import numpy as np
+
+
+class _LazyROOT:
+    """Stand-in for the ROOT module: ROOT is only imported, in batch mode, on first use"""
+
+    def __getattr__(self, name):
+        global rt
+        import ROOT  # type: ignore
+
+        ROOT.gROOT.SetBatch(ROOT.kTRUE)
+        rt = ROOT
+        return getattr(ROOT, name)
+
+
+rt = _LazyROOT()
 
 cms_lumi = "Run 2, 138 fb^{#minus1}"
 cms_energy = "13"
@@ -68,34 +85,72 @@ drawLogo = False
 kSquare = True
 kRectangular = False
 
+
+def GetSettings():
+    """Current text settings drawn on the canvases, e.g. to tell whether a saved plot is outdated"""
+    return {
+        "cms_lumi": cms_lumi,
+        "cms_energy": cms_energy,
+        "cmsText": cmsText,
+        "extraText": extraText,
+        "writeExtraText": writeExtraText,
+        "additionalInfo": list(additionalInfo),
+        "fonts": [cmsTextFont, extraTextFont, additionalInfoFont],
+        "sizes": [lumiTextSize, lumiTextOffset, cmsTextSize, cmsTextOffset, extraOverCmsTextSize],
+        "drawLogo": drawLogo,
+        "palette": MyPalette,
+    }
+
 # Define an alternative color palette and a function to set it
 MyPalette = None
 
-cms_color_map = {
+
+class _ColorMap(Mapping):
+    """Colour names mapped to ROOT colour indices, created on first lookup"""
+
+    def __init__(self, hex_colors):
+        self.hex_colors = hex_colors
+        self._colors = {}
+
+    def __getitem__(self, name):
+        if name not in self._colors:
+            self._colors[name] = rt.TColor.GetColor(self.hex_colors[name])
+        return self._colors[name]
+
+    def __iter__(self):
+        return iter(self.hex_colors)
+
+    def __len__(self):
+        return len(self.hex_colors)
+
+
+_cms_hex_colors = {
     # red
-    "Scarlet": rt.TColor.GetColor("#B81212"),
+    "Scarlet": "#B81212",
     # orange
-    "Tangerine": rt.TColor.GetColor("#FA8C46"),
-    "Butterscotch": rt.TColor.GetColor("#FEB24C"),
+    "Tangerine": "#FA8C46",
+    "Butterscotch": "#FEB24C",
     # green
-    "ForestGreen": rt.TColor.GetColor("#287D46"),
-    "Sage": rt.TColor.GetColor("#7CAFA4"),
-    "Mint": rt.TColor.GetColor("#74C476"),
+    "ForestGreen": "#287D46",
+    "Sage": "#7CAFA4",
+    "Mint": "#74C476",
     # violet
-    "Lavender": rt.TColor.GetColor("#D5BAE2"),
-    "Amethyst": rt.TColor.GetColor("#7f46cf"),
-    "Orchid": rt.TColor.GetColor("#7b2191"),
+    "Lavender": "#D5BAE2",
+    "Amethyst": "#7f46cf",
+    "Orchid": "#7b2191",
     # blue
-    "DeepAzure": rt.TColor.GetColor("#558DC8"),
-    "SkyBlue": rt.TColor.GetColor("#4292C6"),
+    "DeepAzure": "#558DC8",
+    "SkyBlue": "#4292C6",
     # others
-    "LightBlue": rt.TColor.GetColor("#A6BDDB"),
-    "Plum": rt.TColor.GetColor("#714391"),
-    "LightGray": rt.TColor.GetColor("#E6E5E6"),
-    # "Ivory": rt.TColor.GetColor("#FFFFCC"),
-    # "Blueberry": rt.TColor.GetColor("#6A51A3"),
+    "LightBlue": "#A6BDDB",
+    "Plum": "#714391",
+    "LightGray": "#E6E5E6",
+    # "Ivory": "#FFFFCC",
+    # "Blueberry": "#6A51A3",
 }
 
+cms_color_map = _ColorMap(_cms_hex_colors)
+
 
 def CreateAlternativePalette(alpha=1):
     red_values = array("d", [0.00, 0.00, 1.00, 0.70])
@@ -116,6 +171,9 @@ def SetAlternative2DColor(hist=None, style=None, alpha=1):
         global cmsStyle
         style = cmsStyle
     style.SetPalette(len(MyPalette), array("i", MyPalette))
+    # the palette is global in ROOT, whatever the style: setCMSStyle restores it
+    global cmsPaletteChanged
+    cmsPaletteChanged = True
     if hist is not None:
         hist.SetContour(len(MyPalette))
 
@@ -165,6 +223,11 @@ def UpdatePalettePosition(hist, canv=None, X1=None, X2=None, Y1=None, Y2=None, i
 #    ##    ########  ##     ##       ######     ##       ##    ######## ########
 
 cmsStyle = None
+# copy of cmsStyle and of the color palette (kept by ROOT outside of the style) as first built
+cmsStyleDefaults = None
+cmsPaletteDefaults = None
+# set by the functions of this module that change the palette
+cmsPaletteChanged = False
 
 
 # Turns the grid lines on (true) or off (false)
@@ -187,9 +250,17 @@ def UpdatePad(pad=None):
         rt.gPad.Update()
 
 
-def setCMSStyle():
-    global cmsStyle
+def setCMSStyle(force=False):
+    """Build the CMS style once per process; later calls restore it as built, undoing per-plot changes such as cmsGrid or SetAlternative2DColor, unless force is True"""
+    global cmsStyle, cmsStyleDefaults, cmsPaletteDefaults, cmsPaletteChanged
     if cmsStyle != None:
+        if not force:
+            cmsStyleDefaults.Copy(cmsStyle)
+            if cmsPaletteChanged:
+                cmsStyle.SetPalette(len(cmsPaletteDefaults), cmsPaletteDefaults)
+                cmsPaletteChanged = False
+            cmsStyle.cd()
+            return
         del cmsStyle
     cmsStyle = rt.TStyle("cmsStyle", "Style for P-CMS")
     rt.gROOT.SetStyle(cmsStyle.GetName())
@@ -280,6 +351,11 @@ def setCMSStyle():
     cmsStyle.SetHatchesLineWidth(5)
     cmsStyle.SetHatchesSpacing(0.05)
     cmsStyle.cd()
+    cmsStyleDefaults = rt.TStyle("cmsStyleDefaults", "CMS style as built by setCMSStyle")
+    cmsStyle.Copy(cmsStyleDefaults)
+    palette = rt.TColor.GetPalette()
+    cmsPaletteDefaults = np.frombuffer(palette.GetArray(), dtype=np.int32, count=palette.GetSize()).copy()
+    cmsPaletteChanged = False
 
 
 #  ######  ##     ##  ######       ##       ##     ## ##     ## ####
@@ -454,9 +530,9 @@ def cmsCanvasResetAxes(canv, x_min, x_max, y_min, y_max):
     GetcmsCanvasHist(canv).GetYaxis().SetRangeUser(y_min, y_max)
 
 
-def cmsDiCanvas(canvName, x_min, x_max, y_min, y_max, r_min, r_max, nameXaxis, nameYaxis, nameRatio, square=kSquare, iPos=11, extraSpace=0, scaleLumi=None):
-    setCMSStyle()
-
+@lru_cache(maxsize=None)
+def diCanvasGeometry(square, extraSpace=0):
+    """Canvas size, pad heights, margins and title offsets of cmsDiCanvas, computed once per (square, extraSpace)"""
     W_ref = 700 if square else 800
     H_ref = 600 if square else 500
     # Set bottom pad relative height and relative margin
@@ -477,6 +553,16 @@ def cmsDiCanvas(canvName, x_min, x_max, y_min, y_max, r_min, r_max, nameXaxis, n
     Tdw = M_ref * H_ref / Hdw
     Bup = 0.022
     Bdw = B_ref * H_ref / Hdw
+    # title offsets of the upper and lower frames
+    Oup = extraSpace + (1.1 if square else 0.9) * Hup / H_ref
+    Odw = extraSpace + (1.0 if square else 0.8) * Hdw / H_ref
+    return W, H, H_ref, Hup, Hdw, L, R, Tup, Tdw, Bup, Bdw, Oup, Odw
+
+
+def cmsDiCanvas(canvName, x_min, x_max, y_min, y_max, r_min, r_max, nameXaxis, nameYaxis, nameRatio, square=kSquare, iPos=11, extraSpace=0, scaleLumi=None):
+    setCMSStyle()
+
+    W, H, H_ref, Hup, Hdw, L, R, Tup, Tdw, Bup, Bdw, Oup, Odw = diCanvasGeometry(bool(square), extraSpace)
 
     canv = rt.TCanvas(canvName, canvName, 50, 50, W, H)
     canv.SetFillColor(0)
@@ -495,7 +581,7 @@ def cmsDiCanvas(canvName, x_min, x_max, y_min, y_max, r_min, r_max, nameXaxis, n
     rt.gPad.SetBottomMargin(Bup)
 
     hup = canv.cd(1).DrawFrame(x_min, y_min, x_max, y_max)
-    hup.GetYaxis().SetTitleOffset(extraSpace + (1.1 if square else 0.9) * Hup / H_ref)
+    hup.GetYaxis().SetTitleOffset(Oup)
     hup.GetXaxis().SetTitleOffset(999)
     hup.GetXaxis().SetLabelOffset(999)
     hup.SetTitleSize(hup.GetTitleSize("Y") * H_ref / Hup, "Y")
@@ -513,7 +599,7 @@ def cmsDiCanvas(canvName, x_min, x_max, y_min, y_max, r_min, r_max, nameXaxis, n
 
     hdw = canv.cd(2).DrawFrame(x_min, r_min, x_max, r_max)
     # Scale text sizes and margins to match normal size
-    hdw.GetYaxis().SetTitleOffset(extraSpace + (1.0 if square else 0.8) * Hdw / H_ref)
+    hdw.GetYaxis().SetTitleOffset(Odw)
     hdw.GetXaxis().SetTitleOffset(0.9)
     hdw.SetTitleSize(hdw.GetTitleSize("Y") * H_ref / Hdw, "Y")
     hdw.SetLabelSize(hdw.GetLabelSize("Y") * H_ref / Hdw, "Y")
@@ -537,7 +623,10 @@ def cmsDiCanvas(canvName, x_min, x_max, y_min, y_max, r_min, r_max, nameXaxis, n
     return canv
 
 
-def cmsLeg(x1, y1, x2, y2, textSize=0.04, textFont=42, textColor=rt.kBlack, columns=None):
+def cmsLeg(x1, y1, x2, y2, textSize=0.04, textFont=42, textColor=None, columns=None):
+    """textColor defaults to kBlack"""
+    if textColor is None:
+        textColor = rt.kBlack
     leg = rt.TLegend(x1, y1, x2, y2, "", "brNDC")
     leg.SetTextSize(textSize)
     leg.SetTextFont(textFont)
@@ -552,7 +641,10 @@ def cmsLeg(x1, y1, x2, y2, textSize=0.04, textFont=42, textColor=rt.kBlack, colu
 
 
 # To be fixed as python deletes obj before time
-def cmsHeader(leg, legTitle, textAlign=12, textSize=0.04, textFont=42, textColor=rt.kBlack, isToRemove=True):
+def cmsHeader(leg, legTitle, textAlign=12, textSize=0.04, textFont=42, textColor=None, isToRemove=True):
+    """textColor defaults to kBlack"""
+    if textColor is None:
+        textColor = rt.kBlack
     header = rt.TLegendEntry(0, legTitle, "h")
     header.SetTextFont(textFont)
     header.SetTextSize(textSize)
@@ -575,7 +667,16 @@ def cmsHeader(leg, legTitle, textAlign=12, textSize=0.04, textFont=42, textColor
 # ########  ##     ## ##     ##  ###  ###
 
 
-def cmsDraw(h, style, marker=rt.kFullCircle, msize=1.0, mcolor=rt.kBlack, lstyle=rt.kSolid, lwidth=1, lcolor=-1, fstyle=1001, fcolor=rt.kYellow + 1, alpha=-1):
+def cmsDraw(h, style, marker=None, msize=1.0, mcolor=None, lstyle=None, lwidth=1, lcolor=-1, fstyle=1001, fcolor=None, alpha=-1):
+    """marker, mcolor, lstyle and fcolor default to kFullCircle, kBlack, kSolid and kYellow + 1"""
+    if marker is None:
+        marker = rt.kFullCircle
+    if mcolor is None:
+        mcolor = rt.kBlack
+    if lstyle is None:
+        lstyle = rt.kSolid
+    if fcolor is None:
+        fcolor = rt.kYellow + 1
     h.SetMarkerStyle(marker)
     h.SetMarkerSize(msize)
     h.SetMarkerColor(mcolor)
@@ -589,7 +690,12 @@ def cmsDraw(h, style, marker=rt.kFullCircle, msize=1.0, mcolor=rt.kBlack, lstyle
     h.Draw(style + "SAME")
 
 
-def cmsDrawLine(line, lcolor=rt.kRed, lstyle=rt.kSolid, lwidth=2):
+def cmsDrawLine(line, lcolor=None, lstyle=None, lwidth=2):
+    """lcolor and lstyle default to kRed and kSolid"""
+    if lcolor is None:
+        lcolor = rt.kRed
+    if lstyle is None:
+        lstyle = rt.kSolid
     line.SetLineStyle(lstyle)
     line.SetLineColor(lcolor)
     line.SetLineWidth(lwidth)
@@ -600,14 +706,73 @@ def ScaleText(name, scale=0.75):
     return "#scale[" + str(scale) + "]{" + str(name) + "}"
 
 
-def SaveCanvas(canv, path, close=True):
-    """Takes care of fixing overlay and closing object"""
+def SaveCanvas(canv, path, close=True, formats=None):
+    """Takes care of fixing overlay and closing object.
+    With formats (e.g. ["pdf", "png", "svg", "root", "C"]) the canvas is painted once and
+    saved with each extension in place of the one of path. Returns the list of written files."""
+    fixOverlay()
+    if formats:
+        base = os.path.splitext(path)[0]
+        paths = [base + "." + fmt.lstrip(".") for fmt in formats]
+    else:
+        paths = [path]
+    # paint once, every SaveAs below then only writes the current state of the pads
+    canv.Update()
+    for out in paths:
+        canv.SaveAs(out)
+    if close:
+        canv.Close()
+    return paths
+
+
+def OpenBooklet(path, titles=None, linesPerPage=40):
+    """Start a multi-page PDF, pages are then streamed in one by one with AddToBooklet.
+    With titles, the booklet starts with index pages listing them."""
+    canv = rt.TCanvas("cmsBookletIndex", "cmsBookletIndex", 50, 50, 600, 800)
+    canv.Print(path + "[")
+    if titles:
+        latex = rt.TLatex()
+        latex.SetNDC()
+        latex.SetTextFont(42)
+        latex.SetTextSize(0.6 / linesPerPage)
+        latex.SetTextAlign(12)
+        for first in range(0, len(titles), linesPerPage):
+            canv.Clear()
+            for line, title in enumerate(titles[first : first + linesPerPage]):
+                latex.DrawLatex(0.08, 0.95 - 0.9 * line / linesPerPage, f"{first + line + 2 + (len(titles) - 1) // linesPerPage}.  {title}")
+            canv.Print(path, "Title:Index")
+    canv.Close()
+
+
+def AddToBooklet(canv, path, title=None, close=True):
+    """Append a canvas as a new page of a booklet opened with OpenBooklet"""
     fixOverlay()
-    canv.SaveAs(path)
+    canv.Update()
+    canv.Print(path, "Title:" + title if title else "")
     if close:
         canv.Close()
 
 
+def AddPlaceholderToBooklet(path, title, text):
+    """Append a page only showing a title and a message, e.g. in place of a plot that could not be drawn"""
+    canv = rt.TCanvas("cmsBookletPlaceholder", "cmsBookletPlaceholder", 50, 50, 600, 800)
+    latex = rt.TLatex()
+    latex.SetNDC()
+    latex.SetTextFont(42)
+    latex.SetTextSize(0.03)
+    latex.SetTextAlign(22)
+    latex.DrawLatex(0.5, 0.55, title)
+    latex.DrawLatex(0.5, 0.45, text)
+    AddToBooklet(canv, path, title)
+
+
+def CloseBooklet(path):
+    """Finish a booklet opened with OpenBooklet"""
+    canv = rt.TCanvas("cmsBookletEnd", "cmsBookletEnd", 50, 50, 600, 800)
+    canv.Print(path + "]")
+    canv.Close()
+
+
 def FixXAxisPartition(canv, shift=None, textsize=0.05, bins=[30, 100, 300, 1000, 3000]):
     canv.SetLogx(True)
     GetcmsCanvasHist(canv).GetXaxis().SetNoExponent(True)
@@ -0,0 +1,129 @@
+import argparse
+import math
+from typing import List, NamedTuple
+
+import numpy as np
+
+from dat2root import BR, HEPDATA_COVARIANCES, HEPDATA_TABLES, hepdata_covariance, hepdata_edges, hepdata_table
+from envelope import load_grid
+from matrix_io import FLAT_ORDERS, available_scales
+from rebin import get_rebinner
+
+# ===========
+# Compatibility of every (scale, order) prediction of an observable with the measurement: the
+# predictions are stacked as rows of a single array and the chi-square of all of them is a single
+# batched Cholesky solve against the data covariance (plus, optionally, the MC error of each row).
+
+class Comparison(NamedTuple):
+    """ Chi-square, p-value and pulls of several predictions of an observable against the same data """
+
+    observable: str
+    labels: List[str]       # "<scale> <order>" of each row
+    chi2: np.ndarray        # [prediction]
+    ndof: int
+    pvalue: np.ndarray      # [prediction]
+    pulls: np.ndarray       # [prediction, bin], (data - prediction) / total error
+    covariance: bool        # whether the covariance of the measurement was used
+
+
+def chi2_sf(chi2, ndof):
+    """ Probability of a chi-square of ndof degrees of freedom to exceed chi2, with scipy if available """
+
+    chi2 = np.asarray(chi2, dtype=np.float64)
+
+    try:
+        from scipy.stats import chi2 as chi2_dist  # type: ignore
+        return chi2_dist.sf(chi2, ndof)
+    except ImportError:
+        pass
+
+    # closed form of the regularized upper incomplete gamma function Q(ndof/2, chi2/2) for integer ndof:
+    # each term exp(-chi2/2) (chi2/2)^i / Gamma(i + 1), or (chi2/2)^(i + 1/2) / Gamma(i + 3/2) for odd ndof,
+    # is exponentiated from its log as a whole, so that large chi2 and ndof neither overflow nor give 0 * inf
+    half = chi2[..., None] / 2.
+    log_half = np.log(np.maximum(half, np.finfo(np.float64).tiny))
+
+    if ndof % 2 == 0:
+        i = np.arange(ndof // 2)
+        log_terms = i * log_half - np.array([math.lgamma(k + 1.) for k in i])
+        return np.exp(log_terms - half).sum(axis=-1)
+
+    i = np.arange((ndof - 1) // 2)
+    log_terms = (i + .5) * log_half - np.array([math.lgamma(k + 1.5) for k in i])
+    erfc = np.vectorize(math.erfc, otypes=[np.float64])
+
+    return erfc(np.sqrt(half[..., 0])) + np.exp(log_terms - half).sum(axis=-1)
+
+def stacked_chi2(predictions, data, covariance, prediction_errors=None):
+    """ Chi-square and pulls of every row of predictions [prediction, bin] against data, with a batched Cholesky solve """
+
+    residuals = data - predictions
+
+    # one covariance per prediction only when each adds its own uncorrelated error
+    if prediction_errors is not None:
+        covariance = covariance + prediction_errors[:, :, None] * np.eye(len(data))
+
+    cholesky = np.linalg.cholesky(covariance)
+    whitened = np.linalg.solve(np.broadcast_to(cholesky, (len(predictions),) + cholesky.shape[-2:]), residuals[..., None])[..., 0]
+
+    chi2 = np.einsum('kn,kn->k', whitened, whitened)
+    pulls = residuals / np.sqrt(np.diagonal(covariance, axis1=-2, axis2=-1))
+
+    return chi2, pulls
+
+# ===========
+
+def compare_observable(top, scales=None, orders=FLAT_ORDERS, indir="./inputs/{scale}/", mc_errors=True, use_covariance=True):
+    """ Compare every (scale, order) prediction of the pT of a top quark with its HEPData table """
+
+    scales = scales or available_scales(indir)
+    grid = load_grid(f"plot.pT_{top}", scales, orders, indir)
+
+    x, exl, exh, y, eyl, eyh = hepdata_table(HEPDATA_TABLES[top])
+    npoints = len(x)
+
+    # ==== every prediction as a row in the bins of data, in pb like the data
+
+    rebinner = get_rebinner(grid.edges, hepdata_edges(x, exl, exh, HEPDATA_TABLES[top]), overflow="drop")
+
+    nrows = len(grid.scales) * len(grid.orders)
+    predictions = rebinner.values(grid.central).reshape(nrows, npoints) * BR
+    errors = rebinner.errors(grid.central_err).reshape(nrows, npoints) * BR if mc_errors else None
+    labels = [f"{scale} {order}" for scale in grid.scales for order in grid.orders]
+
+    # ==== the covariance of the measurement, or its symmetrized errors without correlations
+
+    covariance = hepdata_covariance(HEPDATA_COVARIANCES[top]) if use_covariance else None
+    if covariance is not None and covariance.shape != (npoints, npoints):
+        raise ValueError(f"covariance '{HEPDATA_COVARIANCES[top]}' is {covariance.shape}, expected {(npoints, npoints)}")
+
+    used_covariance = covariance is not None
+    if not used_covariance:
+        covariance = np.diag(((eyl + eyh) / 2.) ** 2)
+
+    chi2, pulls = stacked_chi2(predictions, np.asarray(y), covariance, errors ** 2 if mc_errors else None)
+
+    return Comparison(top, labels, chi2, npoints, chi2_sf(chi2, npoints), pulls, used_covariance)
+
+def print_comparison(comparison):
+    """ Print a Comparison as a table, one prediction per line """
+
+    source = "covariance" if comparison.covariance else "uncorrelated errors"
+    print(f"{comparison.observable}: {comparison.ndof} bins, data {source}")
+
+    for label, chi2, pvalue, pulls in zip(comparison.labels, comparison.chi2, comparison.pvalue, comparison.pulls):
+        print(f"    {label:<20} chi2 {chi2:9.2f}  p {pvalue:9.3g}  max |pull| {np.abs(pulls).max():5.2f}")
+
+# ===========
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Chi-square, p-values and pulls of every scale and order against the HEPData measurements")
+    parser.add_argument("scales", nargs="*", help="scale choices to compare (default: every one with an input directory)")
+    parser.add_argument("-t", "--tops", nargs="+", default=list(HEPDATA_TABLES))
+    parser.add_argument("--no-mc-errors", dest="mc_errors", action="store_false", help="ignore the MC errors of the predictions")
+    parser.add_argument("--no-covariance", dest="covariance", action="store_false", help="ignore the correlations of the measurement")
+    args = parser.parse_args()
+
+    for top in args.tops:
+        print_comparison(compare_observable(top, args.scales, mc_errors=args.mc_errors, use_covariance=args.covariance))
@@ -1,177 +1,437 @@
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
 import ROOT as rt
-from array import array
 import numpy as np
 
+from manifest import is_up_to_date, save_manifest
+from matrix_io import available_scales, iter_run_distributions, load_cached, order_rank, read_table, select_run_distributions
+from rebin import rebin_table
+
 # ===========
 BR = 0.438 * 2./3.
 # 43.8% for semileptonic, 2/3 for only e and μ, not τ
 
-def dat_to_graph(infile, graph_name):
-    """ Convert a single distribution from a .dat file to a TGraphAssymErrors object """
+# MATRIX run directories give cross sections in fb, the flattened plot.*.dat files and HEPData in pb
+FB_TO_PB = 1.e-3
 
-    arr = np.genfromtxt(infile, usecols=(0,1,2,3,4,5))
+HEPDATA_FILE = './inputs/HEPData-ins1663958-v2-root.root'
 
-    # number of bins
-    nbins = len(arr) - 1
+def make_graph(graph_name, x, exl, exh, y, eyl, eyh):
+    """ Build a TGraphAsymmErrors in a single call from contiguous float64 buffers """
 
-    # binning
-    bin_low = arr[:-1,0]
-    bin_high = arr[1:,0]
+    x, exl, exh, y, eyl, eyh = (np.ascontiguousarray(buf, dtype=np.float64) for buf in (x, exl, exh, y, eyl, eyh))
+
+    graph = rt.TGraphAsymmErrors(len(x), x, y, exl, exh, eyl, eyh)
+    graph.SetName(graph_name)
+
+    return graph
+
+def band_to_graph(graph_name, bin_low, bin_high, center, low, high, npoints):
+    """ Convert the first npoints bins of a scale band to a TGraphAsymmErrors object """
+
+    bin_low = bin_low[:npoints]
+    bin_high = bin_high[:npoints]
     bin_center = (bin_high + bin_low) / 2
 
-    edges = array('d', arr[:, 0])
+    center = center[:npoints]
+
+    return make_graph(graph_name,
+        bin_center, bin_center - bin_low, bin_high - bin_center,
+        center, center - low[:npoints], high[:npoints] - center,
+        )
 
-    # scale value
-    scale_center = arr[:, 1]
-    scale_low = arr[:, 3]
-    scale_high = arr[:, 5]
+def table_to_graph(table, graph_name, factor=None, npoints=None):
+    """ Convert the first npoints bins (default: all) of a DistributionTable to a TGraphAssymErrors object, scaled by factor (default: BR) """
+
+    # binning
+    bin_low = table.edges[:-1]
+    bin_high = table.edges[1:]
 
     # multiplying scale by BR
     global BR
-    scale_center *= BR
-    scale_low *= BR
-    scale_high *= BR
+    factor = BR if factor is None else factor
+    scale_center = table.central * factor
+    scale_low = table.min * factor
+    scale_high = table.max * factor
 
     # ======== converting to TGraphAsymmErrors
 
-    graph = rt.TGraphAsymmErrors()
-    graph.SetName(graph_name)
-    graph.Set(nbins-1)
+    npoints = table.nbins if npoints is None else npoints
 
-    # == filling the graph
-    for i in range(nbins-1):
-        graph.SetPoint(i, bin_center[i], scale_center[i])
-        graph.SetPointError(i, bin_center[i] - bin_low[i], bin_high[i] - bin_center[i],
-            scale_center[i] - scale_low[i], scale_high[i] - scale_center[i],
-            )
+    return band_to_graph(graph_name, bin_low, bin_high, scale_center, scale_low, scale_high, npoints)
 
-    return graph
+def table_to_ratio(table, den_table, graph_name, npoints=None):
+    """ Convert the first npoints bins (default: all) of a DistributionTable to a TGraphAssymErrors object, normalized to den_table """
+
+    # binning
+    bin_low = table.edges[:-1]
+    bin_high = table.edges[1:]
+
+    # ======== Normalizing, empty bins of the reference give 0
+
+    den_arr = den_table.central
+
+    def divide(arr):
+        return np.divide(arr, den_arr, out=np.zeros_like(den_arr), where=den_arr != 0)
+
+    scale_center = divide(table.central)
+    scale_low = divide(table.min)
+    scale_high = divide(table.max)
+
+    # ======== converting to TGraphAsymmErrors
+
+    npoints = table.nbins if npoints is None else npoints
+
+    return band_to_graph(graph_name + "_ratio", bin_low, bin_high, scale_center, scale_low, scale_high, npoints)
+
+def table_to_hist(table, hist_name, factor=None, column="central"):
+    """ Convert a column of a DistributionTable to a TH1D over the MATRIX bin edges, with its MC errors as bin errors, scaled by factor (default: BR) """
+
+    global BR
+    factor = BR if factor is None else factor
+
+    hist = rt.TH1D(hist_name, "", table.nbins, np.ascontiguousarray(table.edges, dtype=np.float64))
+    hist.SetDirectory(rt.nullptr)
+
+    # bulk fill, the first and last cells are the under- and overflow
+    content = np.zeros(table.nbins + 2)
+    content[1:-1] = getattr(table, column) * factor
+    error = np.zeros(table.nbins + 2)
+    error[1:-1] = getattr(table, column + "_err") * factor
+
+    hist.SetContent(content)
+    hist.SetError(error)
+
+    return hist
+
+# the scale band as histograms: suffix of the histogram name and column of the table
+HIST_BAND = {"_TH1D": "central", "_TH1D_down": "min", "_TH1D_up": "max"}
+
+def table_to_hists(table, hist_name, factor=None):
+    """ Convert the scale band of a DistributionTable to three TH1Ds (central, min and max), dividing them by the central TH1D of the reference gives the ratio graph """
+
+    return [table_to_hist(table, hist_name + suffix, factor, column) for suffix, column in HIST_BAND.items()]
+
+def plotted_table(infile):
+    """ DistributionTable of a .dat file without its last bin (800-6500), which has no counterpart in data """
+
+    table = read_table(infile)
+
+    return rebin_table(table, table.edges[:-1], overflow="drop")
+
+def dat_to_graph(infile, graph_name):
+    """ Convert a single distribution from a .dat file to a TGraphAssymErrors object """
+
+    return table_to_graph(plotted_table(infile), graph_name, BR)
+
+def nnlo_path(infile):
+    """ Path of the NNLO distribution matching a given .dat file """
+
+    return '..'.join(infile.split('..')[:-1] + ['NNLO.QCD.dat'])
 
 def dat_to_ratio(infile, graph_name):
     """ Convert a single distribution from a .dat file to a TGraphAssymErrors object, normalized to NNLO """
 
-    arr = np.genfromtxt(infile, usecols=(0,1,2,3,4,5))
+    return table_to_ratio(plotted_table(infile), plotted_table(nnlo_path(infile)), graph_name)
 
-    # number of bins
-    nbins = len(arr) - 1
+# ===========
 
-    # binning
-    bin_low = arr[:-1,0]
-    bin_high = arr[1:,0]
-    bin_center = (bin_high + bin_low) / 2
+HEPDATA_TABLES = {'t1': 'Table 174', 't2': 'Table 176'}
+# covariance matrices of the measurements, used when the file holds them
+HEPDATA_COVARIANCES = {'t1': 'Table 175', 't2': 'Table 177'}
 
-    edges = array('d', arr[:, 0])
+def graph_arrays(graph):
+    """ Zero-copy NumPy views (x, exl, exh, y, eyl, eyh) on the buffers of a TGraphAsymmErrors """
 
-    # scale value
-    scale_center = arr[:, 1]
-    scale_low = arr[:, 3]
-    scale_high = arr[:, 5]
+    npoints = graph.GetN()
+    if npoints == 0:
+        return tuple(np.empty(0) for _ in range(6))
 
-    # ======== Normalizing
+    buffers = (graph.GetX(), graph.GetEXlow(), graph.GetEXhigh(), graph.GetY(), graph.GetEYlow(), graph.GetEYhigh())
 
-    den_arr = np.genfromtxt('..'.join(infile.split('..')[:-1] + ['NNLO.QCD.dat']), usecols = (1))
+    return tuple(np.frombuffer(buf, dtype=np.float64, count=npoints) for buf in buffers)
 
-    scale_center /= den_arr
-    scale_low /= den_arr
-    scale_high /= den_arr
+def read_hepdata_table(path, table_name):
+    """ Read the Graph1D_y1 of a HEPData table as a (6, npoints) array of x, exl, exh, y, eyl, eyh """
 
-    # ======== converting to TGraphAsymmErrors
+    datafile = rt.TFile.Open(path, 'read')
+    graph = datafile.Get(table_name).Get("Graph1D_y1")
+    arr = np.array(graph_arrays(graph))
+    datafile.Close()
 
-    graph = rt.TGraphAsymmErrors()
-    graph.SetName(graph_name + "_ratio")
-    graph.Set(nbins-1)
+    return arr
 
-    # == filling the graph
-    for i in range(nbins-1):
-        graph.SetPoint(i, bin_center[i], scale_center[i])
-        graph.SetPointError(i, bin_center[i] - bin_low[i], bin_high[i] - bin_center[i],
-            scale_center[i] - scale_low[i], scale_high[i] - scale_center[i],
-            )
+def read_hepdata_covariance(path, table_name):
+    """ Read the Hist2D_y1 of a HEPData table as a (n, n) covariance matrix, (0, 0) if the file does not hold it """
 
-    return graph
+    datafile = rt.TFile.Open(path, 'read')
+    table = datafile.Get(table_name)
+    hist = table.Get("Hist2D_y1") if table else None
+
+    if not hist:
+        datafile.Close()
+        return np.empty((0, 0))
+
+    # cells of a TH2 are stored row by row in y, under- and overflow included
+    nx, ny = hist.GetNbinsX(), hist.GetNbinsY()
+    cells = np.frombuffer(hist.GetArray(), dtype=np.float64, count=(nx + 2) * (ny + 2))
+    cov = np.array(cells.reshape(ny + 2, nx + 2)[1:-1, 1:-1])
+    datafile.Close()
+
+    return cov
+
+_hepdata = {}
+
+def hepdata_table(table_name, path=None):
+    """ Arrays of a HEPData table, read from the ROOT file at most once per process and cached on disk """
+
+    path = path or HEPDATA_FILE
+
+    key = (os.path.abspath(path), table_name)
+    if key not in _hepdata:
+        _hepdata[key] = load_cached(path, lambda p: read_hepdata_table(p, table_name), tag="hepdata:" + table_name)
+
+    return _hepdata[key]
+
+def hepdata_covariance(table_name, path=None):
+    """ Covariance matrix of a HEPData table, read like hepdata_table, None if the file does not hold it """
+
+    path = path or HEPDATA_FILE
+
+    key = (os.path.abspath(path), table_name, "covariance")
+    if key not in _hepdata:
+        _hepdata[key] = load_cached(path, lambda p: read_hepdata_covariance(p, table_name), tag="hepdata-covariance:" + table_name)
+
+    return _hepdata[key] if _hepdata[key].size else None
+
+def hepdata_edges(x, exl, exh, table_name):
+    """ Bin edges of a HEPData table, whose bins must be contiguous """
+
+    if not np.allclose((x + exh)[:-1], (x - exl)[1:]):
+        raise ValueError(f"bins of HEPData '{table_name}' are not contiguous: {x - exl} vs {x + exh}")
+
+    return np.append(x - exl, x[-1] + exh[-1])
 
 def normalize_data(indir, top):
     """ Convert a single distribution from a .dat file to a TGraphAssymErrors object, normalized to NNLO """
 
-    scale_nnlo = np.genfromtxt(indir + f'plot.pT_{top}..NNLO.QCD.dat', usecols=(1))
+    nnlo_file = indir + f'plot.pT_{top}..NNLO.QCD.dat'
+    nnlo_table = read_table(nnlo_file)
 
-    global BR
-    scale_nnlo *= BR
+    # ======== getting data 
 
-    # number of bins
-    nbins = len(scale_nnlo) - 1
+    table_name = HEPDATA_TABLES[top]
+    data = hepdata_table(table_name)
 
-    # ======== getting data 
+    graph = make_graph(top + '_data', *data)
+    norm_graph = make_graph(top + '_normalized_data', *data)
 
-    table_idx = {'t1': 'Table 174', 't2': 'Table 176'}[top]
+    # ======== Bringing the prediction to the bins of data
 
-    datafile = rt.TFile.Open('./inputs/HEPData-ins1663958-v2-root.root', 'read')
-    table = datafile.Get(table_idx)
-    graph = table.Get("Graph1D_y1")
-    norm_graph = graph.Clone()
+    x, exl, exh, y, eyl, eyh = graph_arrays(norm_graph)
 
-    graph.SetName(top + '_data')
-    norm_graph.SetName(top + '_normalized_data')
+    try:
+        nnlo = rebin_table(nnlo_table, hepdata_edges(x, exl, exh, table_name), overflow="drop")
+    except ValueError as error:
+        raise ValueError(f"bins of HEPData '{table_name}' do not match {nnlo_file}: {error}") from error
 
-    datafile.Close()
+    # ======== Normalizing, in place on the graph buffers
 
-    # ======== Normalizing
+    global BR
+    scale_nnlo = nnlo.central * BR
 
-    for i in range(nbins-1):
-        norm_graph.SetPointY(i, graph.GetPointY(i) / scale_nnlo[i])
-        norm_graph.SetPointEYlow(i, graph.GetErrorYlow(i) / scale_nnlo[i])
-        norm_graph.SetPointEYhigh(i, graph.GetErrorYhigh(i) / scale_nnlo[i])
+    y /= scale_nnlo
+    eyl /= scale_nnlo
+    eyh /= scale_nnlo
 
     return graph, norm_graph
 
 
 # ===========
 
-def dir_to_root(indir, outpath, varlist):
-    """ Convert a list of distribution in a given directory to a single .root output """
+def dir_inputs(indir, varlist):
+    """ Every file read when converting a directory """
+
+    inputs = [HEPDATA_FILE]
+    inputs += [indir + f'plot.pT_{top}..NNLO.QCD.dat' for top in ['t1', 't2']]
+    for var in varlist:
+        inputs += [indir + var + ".dat", nnlo_path(indir + var + ".dat")]
 
-    # ==== Create a single output file for the whole directory
-    data_graph_t1, data_ratio_graph_t1 = normalize_data(indir, 't1')
-    data_graph_t2, data_ratio_graph_t2 = normalize_data(indir, 't2')
+    return inputs
 
-    outfile = rt.TFile.Open(outpath, "recreate")
+def dir_to_root(indir, outpath, varlist, incremental=False, ratio_graphs=True):
+    """ Convert a list of distribution in a given directory to a single .root output, return False if it was up to date """
 
-    # ==== read, convert and write each distribution to a graph
+    # ==== In incremental mode, skip the conversion if neither the inputs nor the parameters changed
+    manifest_path = outpath + ".manifest.json"
+    params = {"BR": BR, "varlist": list(varlist), "ratio_graphs": ratio_graphs, "hists": list(HIST_BAND)}
+    up_to_date, manifest = is_up_to_date(outpath, manifest_path, dir_inputs(indir, varlist), params)
+    if incremental and up_to_date:
+        return False
+
+    write_objects(dir_objects(indir, varlist, ratio_graphs), outpath)
+
+    save_manifest(manifest_path, manifest)
+
+    return True
+
+def dir_objects(indir, varlist, ratio_graphs=True):
+    """ Build in memory every graph and histogram of a directory, in the order they are written """
+
+    objects = []
+
+    # ==== each distribution to a graph and the histograms of its scale band
     for var in varlist:
-        graph = dat_to_graph(indir + var + ".dat", var)
-        graph.Write()
+        table = plotted_table(indir + var + ".dat")
+        objects.append(table_to_graph(table, var, BR))
+        objects += table_to_hists(table, var)
 
-        ratio_graph = dat_to_ratio(indir + var + ".dat", var)
-        ratio_graph.Write()
+        # without ratio graphs, ratios are computed from the histograms with TH1::Divide
+        if ratio_graphs:
+            objects.append(table_to_ratio(table, plotted_table(nnlo_path(indir + var + ".dat")), var))
 
     # ==== add normalized data
-    
-    data_graph_t1.Write()
-    data_ratio_graph_t1.Write()
+    for top in ['t1', 't2']:
+        objects += normalize_data(indir, top)
+
+    return objects
+
+def write_objects(objects, outpath):
+    """ Write objects to a single .root file """
+
+    # fixed dates and UUID, so that the same inputs always give the same bytes
+    outfile = rt.TFile.Open(outpath + "?reproducible=" + os.path.basename(outpath), "recreate")
+
+    for obj in objects:
+        obj.Write()
+
+    outfile.Close()
+
+def run_to_root(rundir, outpath, incremental=False, ratio_graphs=True):
+    """ Convert every distribution of a raw MATRIX run directory to a single .root output, return False if it was up to date """
+
+    # ==== Discover the distributions, one file per (name, order)
+    selected = select_run_distributions(iter_run_distributions(rundir))
 
-    data_graph_t2.Write()
-    data_ratio_graph_t2.Write()
+    manifest_path = outpath + ".manifest.json"
+    up_to_date, manifest = is_up_to_date(outpath, manifest_path, [dist.path for dist in selected.values()], {"BR": BR, "FB_TO_PB": FB_TO_PB, "ratio_graphs": ratio_graphs, "hists": list(HIST_BAND)})
+    if incremental and up_to_date:
+        return False
+
+    orders = {}
+    for name, order in selected:
+        orders.setdefault(name, []).append(order)
+
+    outfile = rt.TFile.Open(outpath + "?reproducible=" + os.path.basename(outpath), "recreate")
+
+    # ==== each distribution at each order, and its ratio to the highest order available
+    for name in sorted(orders):
+        name_orders = sorted(orders[name], key=order_rank)
+        den_table = read_table(selected[(name, name_orders[-1])].path)
+
+        for order in name_orders:
+            table = read_table(selected[(name, order)].path)
+            graph_name = f"{name}__{order}"
+
+            table_to_graph(table, graph_name, BR * FB_TO_PB).Write()
+            for hist in table_to_hists(table, graph_name, BR * FB_TO_PB):
+                hist.Write()
+            if ratio_graphs:
+                table_to_ratio(table, den_table, graph_name).Write()
 
-    # ==== close the output file
     outfile.Close()
 
+    save_manifest(manifest_path, manifest)
+
+    return True
+
 # ===========
-    
+
+VARLIST = [
+    "plot.pT_t1..LO",
+    "plot.pT_t1..NLO.QCD",
+    "plot.pT_t1..NNLO.QCD",
+    "plot.pT_t2..LO",
+    "plot.pT_t2..NLO.QCD",
+    "plot.pT_t2..NNLO.QCD",
+    ]
+
+def convert_scale(scale, outdir="./outputs/", varlist=VARLIST, incremental=False, ratio_graphs=True):
+    """ Convert the inputs of a single scale choice to outputs/<scale>.root, return a status message """
+
+    indir = f"./inputs/{scale}/"
+    outpath = outdir + scale + ".root"
+
+    if dir_to_root(indir, outpath, varlist, incremental, ratio_graphs):
+        return f"wrote {outpath}"
+    return f"{outpath} is up to date"
+
+def convert_run(rundir, outdir="./outputs/", incremental=False, ratio_graphs=True):
+    """ Convert a raw MATRIX run directory to outputs/<run directory name>.root, return a status message """
+
+    outpath = outdir + os.path.basename(os.path.normpath(rundir)) + ".root"
+
+    if run_to_root(rundir, outpath, incremental, ratio_graphs):
+        return f"wrote {outpath}"
+    return f"{outpath} is up to date"
+
+def run_conversions(tasks, jobs=1):
+    """ Run (label, function, args, kwargs) conversion tasks, in jobs worker processes if jobs > 1 """
+
+    failed = []
+
+    if jobs <= 1:
+        for label, function, args, kwargs in tasks:
+            try:
+                print(f"{label}: {function(*args, **kwargs)}")
+            except Exception as error:
+                print(f"{label}: failed with {error!r}", file=sys.stderr)
+                failed.append(label)
+
+    else:
+        # ROOT global state is not thread safe: one fresh interpreter per worker
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+            futures = [(label, pool.submit(function, *args, **kwargs)) for label, function, args, kwargs in tasks]
+
+            for label, future in futures:
+                try:
+                    print(f"{label}: {future.result()}")
+                except Exception as error:
+                    print(f"{label}: failed with {error!r}", file=sys.stderr)
+                    failed.append(label)
+
+    if failed:
+        raise SystemExit(f"conversion failed for {', '.join(failed)}")
+
+def convert_scales(scales, outdir="./outputs/", jobs=1, incremental=False, rundirs=(), ratio_graphs=True):
+    """ Convert several scale choices and raw run directories, in jobs worker processes if jobs > 1 """
+
+    os.makedirs(outdir, exist_ok=True)
+
+    options = {"incremental": incremental, "ratio_graphs": ratio_graphs}
+    tasks = [(scale, convert_scale, (scale, outdir), options) for scale in scales]
+    tasks += [(rundir, convert_run, (rundir, outdir), options) for rundir in rundirs]
+
+    run_conversions(tasks, jobs)
+
+# ===========
+
 
 if __name__ == "__main__":
-    
-    outdir = "./outputs/"
-    varlist = [
-        "plot.pT_t1..LO",
-        "plot.pT_t1..NLO.QCD",
-        "plot.pT_t1..NNLO.QCD",
-        "plot.pT_t2..LO",
-        "plot.pT_t2..NLO.QCD",
-        "plot.pT_t2..NNLO.QCD",
-        ]
-
-    for scale in ["HT_2", "HT_4", "m_ttx_2", "mT_tx"]:
-
-        indir = f"./inputs/{scale}/"
-        dir_to_root(indir, outdir + scale + ".root", varlist)
 
+    parser = argparse.ArgumentParser(description="Convert MATRIX distributions to .root files, one per scale choice or run directory")
+    parser.add_argument("scales", nargs="*", help="scale choices to convert (default: every one with an input directory, unless --runs is given)")
+    parser.add_argument("-r", "--runs", nargs="+", default=[], help="raw MATRIX run directories to convert, e.g. inputs/run_*")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("-i", "--incremental", action="store_true", help="only rebuild outputs whose inputs or parameters changed")
+    parser.add_argument("--no-ratio-graphs", dest="ratio_graphs", action="store_false", help="only store histograms, ratios are then computed with TH1::Divide when plotting")
+    args = parser.parse_args()
+
+    scales = args.scales or ([] if args.runs else available_scales())
+
+    convert_scales(scales, "./outputs/", jobs=args.jobs, incremental=args.incremental, rundirs=args.runs, ratio_graphs=args.ratio_graphs)
@@ -0,0 +1,151 @@
+import argparse
+import os
+from typing import List, NamedTuple
+
+import numpy as np
+
+from dat2root import BR, band_to_graph, write_objects
+from matrix_io import FLAT_ORDERS, available_scales, read_table
+from rebin import get_rebinner
+
+# ===========
+# Envelope of the predictions across central-scale choices: every scale and order of a distribution
+# is loaded into a single [scale, order, bin] array, so the combined bands are one reduction over the
+# scale axis whatever the number of scale choices.
+
+DISTRIBUTIONS = ["plot.pT_t1", "plot.pT_t2"]
+
+class ScaleGrid(NamedTuple):
+    """ central, min, max and central MC error of a distribution for every scale choice and order, as a [4, scale, order, bin] array """
+
+    name: str
+    scales: List[str]
+    orders: List[str]
+    edges: np.ndarray
+    values: np.ndarray
+
+    @property
+    def central(self):
+        return self.values[0]
+
+    @property
+    def central_err(self):
+        return self.values[3]
+
+    @property
+    def low(self):
+        # min and max are the 7-point band, not necessarily below and above the central value
+        return np.minimum(self.values[1], self.values[2])
+
+    @property
+    def high(self):
+        return np.maximum(self.values[1], self.values[2])
+
+
+class Envelope(NamedTuple):
+    """ [order, bin] arrays combining every scale choice of a ScaleGrid """
+
+    center: np.ndarray          # mean of the central values
+    low: np.ndarray             # lowest edge of all the 7-point bands
+    high: np.ndarray            # highest edge of all the 7-point bands
+    central_low: np.ndarray     # lowest central value
+    central_high: np.ndarray    # highest central value
+    spread: np.ndarray          # standard deviation of the central values
+
+
+def load_grid(name, scales=None, orders=FLAT_ORDERS, indir="./inputs/{scale}/"):
+    """ Load a distribution for every scale choice and order into a ScaleGrid """
+
+    scales = scales or available_scales(indir)
+
+    edges = None
+    values = None
+
+    for i, scale in enumerate(scales):
+        for j, order in enumerate(orders):
+            path = indir.format(scale=scale) + f"{name}..{order}.dat"
+            table = read_table(path)
+
+            if edges is None:
+                edges = table.edges
+                values = np.empty((4, len(scales), len(orders), table.nbins))
+            elif not np.array_equal(table.edges, edges):
+                raise ValueError(f"bins of {path} differ from those of {name} for {scales[0]}")
+
+            values[:, i, j] = table.central, table.min, table.max, table.central_err
+
+    return ScaleGrid(name, list(scales), list(orders), edges, values)
+
+def plotted_grid(grid):
+    """ ScaleGrid without its last bin (800-6500), which has no counterpart in data, like plotted_table """
+
+    rebinner = get_rebinner(grid.edges, grid.edges[:-1], overflow="drop")
+    values = np.concatenate([rebinner.values(grid.values[:3]), rebinner.errors(grid.values[3:])])
+
+    return grid._replace(edges=rebinner.target_edges, values=values)
+
+def compute_envelope(grid):
+    """ Envelope and spread over the scale axis of a ScaleGrid, in one reduction for all orders and bins """
+
+    central = grid.central
+
+    return Envelope(
+        center          = central.mean(axis=0),
+        low             = grid.low.min(axis=0),
+        high            = grid.high.max(axis=0),
+        central_low     = central.min(axis=0),
+        central_high    = central.max(axis=0),
+        spread          = central.std(axis=0),
+        )
+
+# ===========
+
+def envelope_objects(grid, envelope, factor=None):
+    """ Graphs of an Envelope, per order: the combined band and the band of the central values, scaled by factor (default: BR) """
+
+    global BR
+    factor = BR if factor is None else factor
+
+    npoints = len(grid.edges) - 1
+
+    bin_low = grid.edges[:-1]
+    bin_high = grid.edges[1:]
+
+    objects = []
+    for j, order in enumerate(grid.orders):
+        center = envelope.center[j] * factor
+        prefix = f"{grid.name}..{order}"
+
+        objects.append(band_to_graph(prefix + "_envelope", bin_low, bin_high, center, envelope.low[j] * factor, envelope.high[j] * factor, npoints))
+        objects.append(band_to_graph(prefix + "_central_envelope", bin_low, bin_high, center, envelope.central_low[j] * factor, envelope.central_high[j] * factor, npoints))
+        objects.append(band_to_graph(prefix + "_central_spread", bin_low, bin_high, center, center - envelope.spread[j] * factor, center + envelope.spread[j] * factor, npoints))
+
+    return objects
+
+def envelope_to_root(outpath="./outputs/envelope.root", names=DISTRIBUTIONS, scales=None, indir="./inputs/{scale}/"):
+    """ Write the envelope graphs of several distributions over the scale choices to a single .root output, return the scales used """
+
+    scales = scales or available_scales(indir)
+
+    objects = []
+    for name in names:
+        grid = plotted_grid(load_grid(name, scales, FLAT_ORDERS, indir))
+        objects += envelope_objects(grid, compute_envelope(grid))
+
+    os.makedirs(os.path.dirname(outpath) or ".", exist_ok=True)
+    write_objects(objects, outpath)
+
+    return scales
+
+# ===========
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Write the envelopes of the predictions over several central-scale choices")
+    parser.add_argument("scales", nargs="*", help="scale choices to combine (default: every one with an input directory)")
+    parser.add_argument("-o", "--output", default="./outputs/envelope.root")
+    parser.add_argument("-d", "--distributions", nargs="+", default=DISTRIBUTIONS)
+    args = parser.parse_args()
+
+    scales = envelope_to_root(args.output, args.distributions, args.scales)
+    print(f"wrote {args.output} from {', '.join(scales)}")
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# ===========
+
+def file_fingerprint(path, previous=None):
+    """ Size, mtime and sha1 of a file; the hash is reused from previous if size and mtime did not change """
+
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    if previous and all(previous.get(key) == value for key, value in fingerprint.items()):
+        fingerprint["sha1"] = previous["sha1"]
+        return fingerprint
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    fingerprint["sha1"] = sha1.hexdigest()
+
+    return fingerprint
+
+def load_manifest(path):
+    """ Read a json manifest, empty if it is missing or unreadable """
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(path, manifest):
+    """ Atomically write a json manifest """
+
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f.name, path)
+
+# ===========
+
+def inputs_manifest(inputs, params, previous=None):
+    """ Manifest of a build step: fingerprints of its input files and its parameters """
+
+    previous_inputs = (previous or {}).get("inputs", {})
+
+    return {
+        "inputs": {path: file_fingerprint(path, previous_inputs.get(path)) for path in sorted(set(inputs))},
+        "params": params,
+    }
+
+def is_up_to_date(target, manifest_path, inputs, params):
+    """ Check whether target exists and was built from the same inputs and params; returns (status, manifest) """
+
+    previous = load_manifest(manifest_path)
+    manifest = inputs_manifest(inputs, params, previous)
+
+    # mtime and size may differ after a copy or a touch, only the content matters
+    def content(m):
+        return {
+            "inputs": {path: fp["sha1"] for path, fp in m.get("inputs", {}).items()},
+            "params": m.get("params"),
+        }
+
+    up_to_date = os.path.exists(target) and content(previous) == content(manifest)
+
+    return up_to_date, manifest
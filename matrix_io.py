@@ -0,0 +1,315 @@
+import glob
+import hashlib
+import os
+import re
+import tempfile
+from typing import NamedTuple
+
+import numpy as np
+
+# ===========
+
+class DistributionTable(NamedTuple):
+    """ Parsed MATRIX distribution: nbins+1 edges and nbins values for each column """
+
+    edges: np.ndarray
+    central: np.ndarray
+    central_err: np.ndarray
+    min: np.ndarray
+    min_err: np.ndarray
+    max: np.ndarray
+    max_err: np.ndarray
+
+    @property
+    def nbins(self):
+        return len(self.central)
+
+
+# flattened plot.*.dat: one row per left edge, the last row only carries the upper edge
+FLAT_COLUMNS = 7
+# run-directory distributions__*/*.dat: left, right, 6 values and the rel-down/up percentages
+RUN_COLUMNS = 10
+
+def read_columns(path):
+    """ Read a MATRIX .dat file as a (ncols, nrows) float64 array, one contiguous row per column """
+
+    with open(path, 'rb') as f:
+        # sniff the layout from the first data line
+        for line in f:
+            if line.strip() and not line.lstrip().startswith(b'#'):
+                break
+        else:
+            raise ValueError(f"no data in {path}")
+
+    ncols = len(line.split())
+    if ncols == FLAT_COLUMNS:
+        usecols = range(FLAT_COLUMNS)
+    elif ncols == RUN_COLUMNS:
+        # rel-down and rel-up are '%'-suffixed and redundant with min/max
+        usecols = range(RUN_COLUMNS - 2)
+    else:
+        raise ValueError(f"unknown MATRIX layout with {ncols} columns in {path}")
+
+    arr = np.loadtxt(path, dtype=np.float64, comments='#', usecols=usecols, ndmin=2)
+
+    return np.ascontiguousarray(arr.T)
+
+def table_from_columns(cols):
+    """ Build a DistributionTable from the output of read_columns """
+
+    if len(cols) == FLAT_COLUMNS:
+        edges = cols[0]
+        values = cols[1:, :-1]
+    else:
+        edges = np.append(cols[0], cols[1, -1:])
+        values = cols[2:]
+
+    table = DistributionTable(edges, *values)
+
+    # cached tables are shared, nobody should modify them in place
+    for column in table:
+        column.flags.writeable = False
+
+    return table
+
+def parse_table(path):
+    """ Parse a MATRIX .dat file, flattened or from a run directory, into a DistributionTable """
+
+    return table_from_columns(read_columns(path))
+
+# =========== binary cache
+
+# parsed arrays are stored as .npy files named after the source path, mtime and size,
+# so that editing or replacing a source file invalidates its entry
+cache_dir = "./.matrix_cache/"
+
+def set_cache_dir(path):
+    """ Store the binary cache in path, or disable it with None """
+
+    global cache_dir
+    cache_dir = path
+
+def load_cached(path, build, tag="columns"):
+    """ Return build(path), memory-mapped from the binary cache when the entry is up to date """
+
+    if cache_dir is None:
+        return build(path)
+
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+
+    prefix = os.path.join(cache_dir, hashlib.sha1(f"{tag}:{path}".encode()).hexdigest()[:20])
+    cache_path = f"{prefix}-{stat.st_mtime_ns}-{stat.st_size}.npy"
+
+    try:
+        return np.load(cache_path, mmap_mode='r')
+    except (OSError, ValueError):
+        pass
+
+    arr = build(path)
+
+    # the cache is only an accelerator: a read-only or full disk must not break the conversion
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for stale in glob.glob(glob.escape(prefix) + "-*.npy"):
+            os.remove(stale)
+
+        # write then rename, so that concurrent readers never see a partial file
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            np.save(f, arr)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # nor leave a partial file behind
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    return arr
+
+# ===========
+
+_tables = {}
+
+def read_table(path):
+    """ Return the DistributionTable of a .dat file, parsing it at most once per process """
+
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _tables.get(path)
+    if cached is None or cached[0] != key:
+        cached = _tables[path] = (key, table_from_columns(load_cached(path, read_columns)))
+
+    return cached[1]
+
+def clear_tables():
+    """ Forget every table parsed so far """
+
+    _tables.clear()
+
+# =========== flattened inputs, one directory per scale choice
+
+SCALES = ["HT_2", "HT_4", "m_ttx_2", "mT_tx"]
+
+# perturbative orders as named in the flattened plot.<name>..<order>.dat files, from lowest to highest
+FLAT_ORDERS = ["LO", "NLO.QCD", "NNLO.QCD"]
+
+def available_scales(indir="./inputs/{scale}/"):
+    """ Scale choices with an input directory """
+
+    return [scale for scale in SCALES if os.path.isdir(indir.format(scale=scale))]
+
+# =========== MATRIX run directories
+
+# perturbative orders, from lowest to highest
+ORDERS = ["LO", "NLO_QCD", "NNLO_QCD"]
+
+def run_order(order):
+    """ Order as named in run directories, e.g. NLO_QCD for the NLO.QCD of the flattened files and result summaries """
+
+    return order.replace(".", "_")
+
+class RunDistribution(NamedTuple):
+    """ A distribution file of a MATRIX run directory, e.g. NLO-run/distributions__NLO_QCD/pT_thigh__NLO_QCD.dat """
+
+    run: str
+    order: str
+    name: str
+    path: str
+
+
+def order_rank(order):
+    """ Sort key of a perturbative order, unknown orders last """
+
+    return ORDERS.index(order) if order in ORDERS else len(ORDERS)
+
+def dedicated_run(order):
+    """ Name of the run computing a given order, e.g. NLO-run for NLO_QCD """
+
+    return order.split("_")[0] + "-run"
+
+def _sorted_entries(path):
+    with os.scandir(path) as it:
+        return sorted(it, key=lambda entry: entry.name)
+
+def iter_run_distributions(rundir, saved=False):
+    """ Walk a MATRIX run directory and yield its RunDistributions one by one, without reading them """
+
+    for entry in _sorted_entries(rundir):
+        if not entry.is_dir():
+            continue
+
+        if entry.name.endswith("-run"):
+            for dist_dir in _sorted_entries(entry.path):
+                if not (dist_dir.is_dir() and dist_dir.name.startswith("distributions__")):
+                    continue
+
+                order = dist_dir.name[len("distributions__"):]
+                suffix = f"__{order}.dat"
+
+                for dist in _sorted_entries(dist_dir.path):
+                    # skip editor swap files and other hidden files
+                    if dist.name.startswith(".") or not dist.name.endswith(suffix):
+                        continue
+                    yield RunDistribution(entry.name, order, dist.name[:-len(suffix)], dist.path)
+
+        # earlier runs of the same setup, saved by MATRIX
+        elif saved and entry.name.startswith("saved_result_"):
+            for dist in iter_run_distributions(entry.path):
+                yield dist._replace(run=entry.name + "/" + dist.run)
+
+def select_run_distributions(distributions):
+    """ Keep one RunDistribution per (name, order), preferring the run dedicated to that order """
+
+    selected = {}
+    for dist in distributions:
+        key = (dist.name, dist.order)
+        # runs are walked from lowest to highest, so the fallback is the highest run
+        if key not in selected or selected[key].run != dedicated_run(dist.order):
+            selected[key] = dist
+
+    return selected
+
+# =========== total rates
+
+# one row per order and run: the rate in pb, its MC error and the relative muR, muF variations;
+# orders are always named as in run directories (NLO_QCD), see run_order
+RATE_DTYPE = np.dtype([
+    ("run", "U32"),
+    ("order", "U16"),
+    ("pdf", "U64"),
+    ("rate", "f8"),
+    ("error", "f8"),
+    ("scale_up", "f8"),
+    ("scale_down", "f8"),
+])
+
+UNITS_TO_PB = {"fb": 1.e-3, "pb": 1., "nb": 1.e3}
+
+_run_header = re.compile(r"#\s*(\S+-run)\s*\|")
+_pdf_line = re.compile(r"<MATRIX-RESULT>\s*PDF:\s*(\S+)")
+_rate_line = re.compile(
+    r"<MATRIX-RESULT>\s*([\w.]+):\s*(\S+)\s+(\w+)\s*\+/-\s*(\S+)\s+(\w+)"
+    r"\s*\(muR, muF unc\.:\s*([-+\d.eE]+)%\s*([-+\d.eE]+)%\)"
+)
+
+def parse_result_summary(path):
+    """ Parse the <MATRIX-RESULT> lines of a summary/result_summary.dat into a RATE_DTYPE array """
+
+    rows = []
+    run = pdf = ""
+
+    with open(path) as f:
+        for line in f:
+            if match := _run_header.search(line):
+                run = match.group(1)
+            elif match := _pdf_line.search(line):
+                pdf = match.group(1)
+            elif match := _rate_line.search(line):
+                order, rate, unit, error, error_unit, up, down = match.groups()
+                rows.append((run, run_order(order), pdf,
+                    float(rate) * UNITS_TO_PB[unit], float(error) * UNITS_TO_PB[error_unit],
+                    float(up) / 100., float(down) / 100.))
+
+    return np.array(rows, dtype=RATE_DTYPE)
+
+def read_result_summary(path):
+    """ RATE_DTYPE array of a result_summary.dat, from the binary cache when it is up to date """
+
+    return load_cached(path, parse_result_summary, tag="result-summary")
+
+def rate_from_table(table, run="", order="", pdf=""):
+    """ RATE_DTYPE row of a single-bin plot.total_rate..*.dat table, already in pb """
+
+    rate = table.central[0]
+
+    # min and max of the 7-point band, relative to the central rate
+    return np.array((run, run_order(order), pdf, rate, table.central_err[0], max(table.min[0], table.max[0]) / rate - 1., min(table.min[0], table.max[0]) / rate - 1.), dtype=RATE_DTYPE)
+
+# =========== writing
+
+RUN_HEADER = "#  left-edge  right-edge       scale-central  central-error        scale-min      min-error        scale-max      max-error      rel-down     rel-up\n"
+
+def write_run_table(path, table):
+    """ Write a DistributionTable in the layout of the run-directory distributions, readable by read_columns """
+
+    # relative scale band in percent, 0 for empty bins
+    central = np.asarray(table.central)
+    rel_down = np.divide(table.min, central, out=np.ones_like(central), where=central != 0) * 100. - 100.
+    rel_up = np.divide(table.max, central, out=np.ones_like(central), where=central != 0) * 100. - 100.
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    # write then rename, like the binary cache
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+        f.write(RUN_HEADER)
+        for row in zip(table.edges[:-1], table.edges[1:], table.central, table.central_err, table.min, table.min_err, table.max, table.max_err, rel_down, rel_up):
+            low, high, *values, down, up = row
+            f.write(f"{low:12g}{high:12g}" + "".join(f"{v:17.8g}" for v in values) + f"{down:12.2f}%{up:10.2f}%\n")
+    os.replace(f.name, path)
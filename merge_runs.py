@@ -0,0 +1,107 @@
+import argparse
+import os
+
+import numpy as np
+
+from matrix_io import DistributionTable, iter_run_distributions, load_cached, read_columns, table_from_columns, write_run_table
+
+# ===========
+# MATRIX keeps the earlier runs of a setup in saved_result_<N>/. Each distribution of each run
+# (LO-run, NLO-run, ...) is merged over the current and saved results by inverse-variance
+# weighting, reading one file at a time: memory does not grow with the number of runs.
+
+class TableMerger:
+    """ Running inverse-variance weighted mean of the central, min and max columns of DistributionTables """
+
+    def __init__(self):
+        self.edges = None
+        self.count = 0
+
+    def add(self, table, source=""):
+        """ Add one table, its bins must be those of the first one """
+
+        values = np.array([table.central, table.min, table.max])
+        errors = np.array([table.central_err, table.min_err, table.max_err])
+
+        if self.edges is None:
+            self.edges = np.array(table.edges)
+            self.sum_weights = np.zeros_like(values)
+            self.sum_weighted = np.zeros_like(values)
+            self.sum_values = np.zeros_like(values)
+        elif not np.array_equal(table.edges, self.edges):
+            raise ValueError(f"bins of {source or 'table'} differ from those of the runs merged so far")
+
+        weights = np.divide(1., errors ** 2, out=np.zeros_like(errors), where=errors > 0)
+
+        # entries without error (e.g. empty tail bins of short runs) get no weight, they only count
+        # when no run at all has an error for that bin, which then falls back to the plain mean
+        self.sum_weights += weights
+        self.sum_weighted += weights * values
+        self.sum_values += values
+        self.count += 1
+
+    def table(self):
+        """ Merged DistributionTable """
+
+        if not self.count:
+            raise ValueError("no table to merge")
+
+        weighted = np.divide(self.sum_weighted, self.sum_weights, out=np.zeros_like(self.sum_weighted), where=self.sum_weights > 0)
+        weighted_err = np.divide(1., np.sqrt(self.sum_weights), out=np.zeros_like(self.sum_weights), where=self.sum_weights > 0)
+
+        unweighted = self.sum_weights == 0
+        values = np.where(unweighted, self.sum_values / self.count, weighted)
+        errors = np.where(unweighted, 0., weighted_err)
+
+        central, minimum, maximum = values
+        central_err, min_err, max_err = errors
+
+        return DistributionTable(self.edges, central, central_err, minimum, min_err, maximum, max_err)
+
+
+def merge_tables(paths):
+    """ Merge the distributions of several runs, read one by one """
+
+    merger = TableMerger()
+    for path in paths:
+        merger.add(table_from_columns(load_cached(path, read_columns)), path)
+
+    return merger.table()
+
+# ===========
+
+def repeated_runs(rundir):
+    """ Paths of each (run, order, name) distribution of a run directory, over its current and saved results """
+
+    groups = {}
+    for dist in iter_run_distributions(rundir, saved=True):
+        # saved_result_1/LO-run repeats LO-run
+        run = dist.run.split("/")[-1]
+        groups.setdefault((run, dist.order, dist.name), []).append(dist.path)
+
+    return groups
+
+def merge_run(rundir, outdir):
+    """ Merge the current and saved results of a run directory into a run directory of the same layout, return {(run, order, name): number of runs merged} """
+
+    merged = {}
+    for (run, order, name), paths in sorted(repeated_runs(rundir).items()):
+        outpath = os.path.join(outdir, run, f"distributions__{order}", f"{name}__{order}.dat")
+        write_run_table(outpath, merge_tables(paths))
+        merged[(run, order, name)] = len(paths)
+
+    return merged
+
+# ===========
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Merge the repeated runs (saved_result_<N>) of MATRIX run directories by inverse-variance weighting")
+    parser.add_argument("rundirs", nargs="+", help="raw MATRIX run directories, e.g. inputs/run_*")
+    parser.add_argument("-o", "--outdir", default="./inputs/", help="the merged run of <rundir> is written to <outdir>/<rundir name>_merged")
+    args = parser.parse_args()
+
+    for rundir in args.rundirs:
+        outdir = os.path.join(args.outdir, os.path.basename(os.path.normpath(rundir)) + "_merged")
+        merged = merge_run(rundir, outdir)
+        print(f"{rundir}: wrote {len(merged)} distributions to {outdir}, from up to {max(merged.values(), default=0)} runs each")
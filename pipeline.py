@@ -0,0 +1,75 @@
+import argparse
+import os
+import sys
+import time
+
+import ROOT as rt  # type: ignore
+
+import plots_bnd
+from dat2root import VARLIST, dir_objects, write_objects
+from plot_spec import DEFAULT_SPEC, load_spec
+
+# plots are only written to files, no graphics window
+rt.gROOT.SetBatch(True)
+
+# ===========
+# dat2root.py then plots_bnd.py, fused in a single ROOT session: the graphs built from the
+# MATRIX and HEPData inputs are handed to the plotting in memory instead of going through
+# outputs/<scale>.root, which is only written on request.
+
+def build_scale(scale, spec=DEFAULT_SPEC, indir="./inputs/{scale}/", varlist=VARLIST, ratio_graphs=True, persist=False):
+    """ Build the objects of one scale choice and serve them to the plots under the spec input path, optionally written there too """
+
+    objects = dir_objects(indir.format(scale=scale), varlist, ratio_graphs)
+    inpath = spec["input"].format(scale=scale)
+
+    if persist:
+        os.makedirs(os.path.dirname(inpath) or ".", exist_ok=True)
+        write_objects(objects, inpath)
+
+    plots_bnd.add_objects(inpath, objects)
+
+    return inpath
+
+def run_pipeline(scales=None, spec=DEFAULT_SPEC, indir="./inputs/{scale}/", varlist=VARLIST, ratio_graphs=True, persist=False, formats=("pdf",), booklet=None, index=False, force=False):
+    """ Convert the inputs and render the plots of several scale choices in this process """
+
+    scales = scales or list(spec["scales"])
+
+    # scale choices without inputs are reported and left out, the others are still plotted
+    missing = [scale for scale in scales if not os.path.isdir(indir.format(scale=scale))]
+    for scale in missing:
+        print(f"{scale}: no input directory {indir.format(scale=scale)}, skipped", file=sys.stderr)
+    scales = [scale for scale in scales if scale not in missing]
+
+    start = time.perf_counter()
+    for scale in scales:
+        inpath = build_scale(scale, spec, indir, varlist, ratio_graphs, persist)
+        print(f"{scale}: built in memory" + (f", wrote {inpath}" if persist else ""))
+    built = time.perf_counter()
+
+    if not scales:
+        raise SystemExit("no scale choice to plot")
+
+    plots_bnd.main(spec=spec, jobs=1, formats=formats, booklet=booklet, index=index, force=force, scales=scales)
+
+    print(f"conversion {built - start:.2f} s, plots {time.perf_counter() - built:.2f} s")
+
+# ===========
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Convert the MATRIX and HEPData inputs and plot them in a single process, without reading back outputs/*.root")
+    parser.add_argument("scales", nargs="*", help="scale choices to process (default: all those of the spec)")
+    parser.add_argument("-s", "--spec", help=".json or .yaml plot spec (default: the built-in one, see plot_spec.py)")
+    parser.add_argument("-p", "--persist", action="store_true", help="also write the converted objects to the input files of the spec")
+    parser.add_argument("--no-ratio-graphs", dest="ratio_graphs", action="store_false", help="do not build ratio graphs, the plots divide the histograms of the scale bands instead")
+    parser.add_argument("-f", "--formats", nargs="*", default=["pdf"], help="output formats written from a single render, e.g. pdf png svg root C (none: booklet only)")
+    parser.add_argument("-b", "--booklet", help="also stream every plot into this multi-page PDF")
+    parser.add_argument("--index", action="store_true", help="start the booklet with an index page")
+    parser.add_argument("--force", action="store_true", help="render every plot, even those saved from the same inputs, spec and style")
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec) if args.spec else DEFAULT_SPEC
+
+    run_pipeline(args.scales, spec, ratio_graphs=args.ratio_graphs, persist=args.persist, formats=args.formats, booklet=args.booklet, index=args.index, force=args.force)
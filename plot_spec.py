@@ -0,0 +1,174 @@
+import argparse
+import json
+from typing import NamedTuple, Optional, Tuple
+
+# ===========
+# A spec describes the plot book declaratively: which converted files to read (one per scale
+# choice), which observables to draw and, for each observable, the graphs at each order,
+# the data, the axes and the labels. build_plan expands it into one PlotJob per
+# (scale, observable), grouped per input file.
+
+DEFAULT_SPEC = {
+    "input": "./outputs/{scale}.root",
+    "output": "./plots/{scale}_{observable}.pdf",
+    "lumi": "2016, 35.8 fb^{#minus1}",
+
+    "scales": {
+        "HT_2": "H_{T} / 2",
+        "HT_4": "H_{T} / 4",
+        "m_ttx_2": r"m_{t\bar{t}} / 2",
+        "mT_tx": r"m_{T, \bar{t}}",
+    },
+
+    # {order} in the graph names of the observables is replaced by each key
+    "orders": [
+        {"key": "LO", "label": "LO", "color": "#5790fc"},
+        {"key": "NLO.QCD", "label": "NLO", "color": "#f89c20"},
+        {"key": "NNLO.QCD", "label": "NNLO", "color": "#e42536"},
+    ],
+
+    # an observable may fix some of its "ranges", e.g. {"r": (0.2, 1.3)}, the others enclose what is drawn
+    "observables": {
+        "t1": {
+            "graph": "plot.pT_t1..{order}",
+            "data": "t1_data",
+            "data_ratio": "t1_normalized_data",
+            "axes": {"x": "p_{T, t_{high}}", "y": r"d\sigma/dp_{T, t_{high}} [pb #times GeV^{-1}]", "r": r"\frac{Data}{NNLO}"},
+            "log": {"x": False, "y": True},
+        },
+        "t2": {
+            "graph": "plot.pT_t2..{order}",
+            "data": "t2_data",
+            "data_ratio": "t2_normalized_data",
+            "axes": {"x": "p_{T, t_{low}}", "y": r"d\sigma/dp_{T, t_{low}} [pb #times GeV^{-1}]", "r": r"\frac{Data}{NNLO}"},
+            "log": {"x": False, "y": True},
+        },
+    },
+}
+
+# ===========
+
+class Curve(NamedTuple):
+    """ A prediction drawn on a plot: its graph, its ratio graph and the histograms to fall back on """
+
+    graph: str
+    ratio: str
+    # central, min and max of the scale band
+    hists: Tuple[str, str, str]
+    label: str
+    color: str
+
+
+class PlotJob(NamedTuple):
+    """ Everything needed to render one plot, independent of any other job """
+
+    scale: str
+    scale_label: str
+    observable: str
+    infile: str
+    outpath: str
+    title: str
+    lumi: str
+    curves: Tuple[Curve, ...]
+    reference_hist: str
+    data: Optional[str]
+    data_ratio: Optional[str]
+    axes: dict
+    ranges: dict
+    log: dict
+    # every object read from infile by the whole plan, loaded in one pass by the first job
+    file_objects: Tuple[str, ...]
+
+
+def load_spec(path):
+    """ Read a spec from a .json or .yaml file, missing top-level keys are taken from DEFAULT_SPEC """
+
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml  # type: ignore
+            except ImportError:
+                raise ImportError("PyYAML is needed to read YAML specs, use a .json spec instead")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    return {**DEFAULT_SPEC, **spec}
+
+def build_plan(spec=DEFAULT_SPEC, scales=None, observables=None):
+    """ Expand a spec into PlotJobs, jobs reading the same file follow each other """
+
+    scales = scales or list(spec["scales"])
+    observables = observables or list(spec["observables"])
+
+    jobs = []
+    for scale in scales:
+
+        infile = spec["input"].format(scale=scale)
+        scale_jobs = []
+
+        for observable in observables:
+            obs = spec["observables"][observable]
+            orders = obs.get("orders", spec["orders"])
+
+            curves = []
+            for order in orders:
+                graph = obs["graph"].format(order=order["key"])
+                hists = (graph + "_TH1D", graph + "_TH1D_down", graph + "_TH1D_up")
+                curves.append(Curve(graph, graph + "_ratio", hists, order["label"], order["color"]))
+
+            # ratios are taken with respect to the last order unless told otherwise
+            reference = obs.get("reference", orders[-1]["key"])
+
+            scale_jobs.append(PlotJob(
+                scale           = scale,
+                scale_label     = spec["scales"][scale],
+                observable      = observable,
+                infile          = infile,
+                outpath         = spec["output"].format(scale=scale, observable=obs.get("output", observable)),
+                title           = f"{scale} {observable}",
+                lumi            = obs.get("lumi", spec["lumi"]),
+                curves          = tuple(curves),
+                reference_hist  = obs["graph"].format(order=reference) + "_TH1D",
+                data            = obs.get("data"),
+                data_ratio      = obs.get("data_ratio"),
+                axes            = obs["axes"],
+                ranges          = obs.get("ranges", {}),
+                log             = obs.get("log", {"x": False, "y": True}),
+                file_objects    = (),
+                ))
+
+        # ==== deduplicate the objects read from this file, so that they are read once in one pass
+        names = set()
+        for job in scale_jobs:
+            names.update(job_objects(job))
+        jobs += [job._replace(file_objects=tuple(sorted(names))) for job in scale_jobs]
+
+    return jobs
+
+def job_objects(job):
+    """ Names of the objects a job may read from its input file """
+
+    names = [job.reference_hist]
+    for curve in job.curves:
+        names += [curve.graph, curve.ratio, *curve.hists]
+    names += [name for name in (job.data, job.data_ratio) if name]
+
+    return names
+
+# ===========
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Print the render plan of a plot spec")
+    parser.add_argument("spec", nargs="?", help=".json or .yaml spec (default: the built-in one)")
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec) if args.spec else DEFAULT_SPEC
+
+    infile = None
+    for job in build_plan(spec):
+        if job.infile != infile:
+            infile = job.infile
+            print(f"{infile}: {len(job.file_objects)} objects")
+        print(f"    {job.title:<20} -> {job.outpath}")
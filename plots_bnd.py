@@ -1,18 +1,128 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import ROOT as rt  # type: ignore
+import numpy as np
 import cmsstyle as CMS
+from dat2root import band_to_graph, graph_arrays
+from manifest import file_fingerprint, load_manifest, save_manifest
+from plot_spec import DEFAULT_SPEC, build_plan, job_objects, load_spec
 import math
 
+# plots are only written to files: no graphics window, in this process and in the spawned workers,
+# which import this module; cmsstyle only sets batch mode once its own ROOT proxy is first used
+rt.gROOT.SetBatch(True)
+
+EXTRA_TEXT = r"BR(t\bar{t}\rightarrowq\bar{q'}l^{\pm}\nu_{l}) = 29.2% (l = e, \mu)"
+
+def object_extent(obj):
+    """ Low and high x and y of every point of a graph or histogram, error bars included, as NumPy views where possible """
+
+    if isinstance(obj, rt.TGraphAsymmErrors):
+        x, exl, exh, y, eyl, eyh = graph_arrays(obj)
+        return x - exl, x + exh, y - eyl, y + eyh
+
+    nbins = obj.GetNbinsX()
+    axis = obj.GetXaxis()
+    if axis.GetXbins().GetSize():
+        edges = np.frombuffer(axis.GetXbins().GetArray(), dtype=np.float64, count=nbins + 1)
+    else:
+        edges = np.linspace(axis.GetXmin(), axis.GetXmax(), nbins + 1)
+
+    # underflow and overflow are not drawn
+    content = np.frombuffer(obj.GetArray(), dtype=np.float64, count=nbins + 2)[1:-1]
+    if obj.GetSumw2N():
+        error = np.sqrt(np.frombuffer(obj.GetSumw2().GetArray(), dtype=np.float64, count=nbins + 2)[1:-1])
+    else:
+        error = np.sqrt(np.abs(content))
+
+    return edges[:-1], edges[1:], content - error, content + error
+
+def padded_range(low, high, log, below, above):
+    """ [low, high] widened by the fractions below and above of its span, in log space for a log axis """
+
+    if log:
+        low, high = np.log10(low), np.log10(high)
+    span = (high - low) or 1.
+    low, high = low - below * span, high + above * span
+    if log:
+        low, high = 10 ** low, 10 ** high
+
+    return float(low), float(high)
+
+def auto_ranges(
+        objects,                # List of graphs and histograms of the upper pad
+        ratio_objects   = (),   # List of graphs and histograms of the ratio pad
+        logAxis         = {"x": False, "y": True},
+        top_space       = 0.45, # room left above the curves for the legend and labels
+        ):
+    """ x and y ranges enclosing every point of objects, ratio range enclosing those of ratio_objects, each computed in one vectorized pass """
+
+    ranges = {}
+
+    if objects:
+        extents = [object_extent(obj) for obj in objects]
+        x_low, x_high, y_low, y_high = (np.concatenate(arrays) for arrays in zip(*extents))
+
+        # ==== x: the bins as they are, without padding
+
+        x_ok = np.isfinite(x_low) & np.isfinite(x_high)
+        if logAxis.get("x"):
+            x_ok &= x_low > 0
+        ranges["x"] = (float(x_low[x_ok].min()), float(x_high[x_ok].max())) if x_ok.any() else (0., 1.)
+
+        # ==== y: on a log axis only positive values can be shown, lower error bars reaching 0 are cut
+
+        if logAxis.get("y"):
+            y_low = np.where(y_low > 0, y_low, y_high)
+            y_ok = (y_low > 0) & np.isfinite(y_low) & np.isfinite(y_high)
+        else:
+            y_ok = np.isfinite(y_low) & np.isfinite(y_high)
+        y_ok &= x_ok
+
+        if y_ok.any():
+            ranges["y"] = padded_range(y_low[y_ok].min(), y_high[y_ok].max(), logAxis.get("y"), 0.05, top_space)
+        else:
+            ranges["y"] = (1.e-3, 1.) if logAxis.get("y") else (0., 1.)
+
+    # ==== ratio: points without a reference are set to 0 and are left out
+
+    if ratio_objects:
+        r_low, r_high = (np.concatenate(arrays) for arrays in zip(*[object_extent(obj)[2:] for obj in ratio_objects]))
+        r_ok = np.isfinite(r_low) & np.isfinite(r_high) & ((r_low != 0) | (r_high != 0))
+        if r_ok.any():
+            ranges["r"] = padded_range(min(r_low[r_ok].min(), 1.), max(r_high[r_ok].max(), 1.), False, 0.1, 0.1)
+        else:
+            ranges["r"] = (0.5, 1.5)
+
+    return ranges
+
+# ===========
+
 def create_canvas(
         canvName,   # str
-        ranges,     # Dict[str, Tuple[float, float]],
+        ranges,     # Dict[str, Tuple[float, float]], ranges missing are computed from the objects
         nameAxis,   # Dict[str, str],
         logAxis     = {"x": False, "y": True, "z": False},
         square      = CMS.kRectangular,
         extraSpace  = 0,
+        objects     = (),   # List of graphs and histograms going onto the upper pad
+        ratio_objects = (), # List of graphs and histograms going onto the ratio pad
         ):
     """ Create a canvas object """
 
+    # === fill in the ranges not given, the frame is drawn with them: x and y from the upper pad, r from the ratio pad
+
+    upper_missing = objects and not all(axis in ranges for axis in ("x", "y"))
+    ratio_missing = ratio_objects and "r" not in ranges
+    if upper_missing or ratio_missing:
+        ranges = {**auto_ranges(objects if upper_missing else (), ratio_objects if ratio_missing else (), logAxis), **ranges}
+
     # === put arguments in a dict
 
     canv_infos = {
@@ -33,7 +143,7 @@ def create_canvas(
 
     # ==== Set up left text inside canvas
 
-    CMS.SetExtraText(r"BR(t\bar{t}\rightarrowq\bar{q'}l^{\pm}\nu_{l}) = 29.2% (l = e, \mu)" )
+    CMS.SetExtraText(EXTRA_TEXT)
 
     # ==== Create ref to upper and ratio pad
 
@@ -100,204 +210,387 @@ def create_leg(
 
 # =============
 
-def main():
+def hist_ratio(num, den, name=None):
+    """ Ratio of two histograms, computed natively with TH1::Divide """
 
-    palette = ['#5790fc', '#f89c20', '#e42536']
-    root_palette = [rt.TColor.GetColor(c) for c in palette]
+    ratio = num.Clone(name or num.GetName() + "_ratio")
+    ratio.SetDirectory(rt.nullptr)
+    ratio.Divide(den)
 
-    # ======== I/O
+    return ratio
+
+def hist_band_ratio(hists, den, name):
+    """ Scale band given as (central, min, max) histograms divided by a reference histogram, as a graph like the ratio graphs of dat2root """
+
+    ratios = [hist_ratio(hist, den) for hist in hists]
+    center, low, high = (np.frombuffer(ratio.GetArray(), dtype=np.float64, count=ratio.GetNcells())[1:-1] for ratio in ratios)
+
+    xbins = den.GetXaxis().GetXbins()
+    edges = np.frombuffer(xbins.GetArray(), dtype=np.float64, count=xbins.GetSize())
+
+    # empty bins of the reference give 0, as in the ratio graphs
+    return band_to_graph(name, edges[:-1], edges[1:], center, low, high, len(center))
+
+# =============
+
+_objects = {}
+_complete = set()
+
+def load_objects(path, names=None):
+    """ Read the objects of a converted .root file in one pass, detached from the file and kept for the whole process; all of them unless names are given """
+
+    objects = _objects.setdefault(path, {})
 
-    indir = "./outputs/"
-    outdir = "./plots/"
-    scales = ["HT_2", "HT_4", "m_ttx_2", "mT_tx"]
+    # everything the file holds, or everything built in memory by add_objects, is already there: missing names are absent
+    if path in _complete:
+        return objects
 
-    for top in ["t1", "t2"]:
+    if names is not None:
+        names = [name for name in names if name not in objects]
+        if not names:
+            return objects
 
-        top_label = {"t1": "t_{high}", "t2": "t_{low}"}[top]
+    infile = rt.TFile.Open(path, "read")
+    if not infile or infile.IsZombie():
+        raise OSError(f"cannot open {path}")
 
-        for fname in scales:
+    if names is None:
+        # keys are sorted by decreasing cycle, keep the latest one
+        names = list(dict.fromkeys(key.GetName() for key in infile.GetListOfKeys()))
+        _complete.add(path)
 
-            CMS.SetLumi("2016, 35.8 fb^{#minus1}", unit = None)
+    for name in names:
+        obj = infile.Get(name)
+        # missing objects are remembered too, so that they are not looked up again
+        if obj:
+            if hasattr(obj, "SetDirectory"):
+                obj.SetDirectory(rt.nullptr)
+            rt.SetOwnership(obj, True)
+        objects[name] = obj or None
 
-            # =========== creating canvas and legend
+    infile.Close()
 
-            canv, upper_pad, ratio_pad = create_canvas(
-                    canvName    = "test_canvas",
-                    ranges      = {"x": (0., 800.), "y": (5.e-4, 1.e1), "r": (0.2, 1.3)},
-                    logAxis     = {"x": False, "y": True}, 
-                    nameAxis    = {"x": f"p_{{T, {top_label}}}", "y": rf"d\sigma/dp_{{T, {top_label}}} [pb #times GeV^{{-1}}]", "r": r"\frac{Data}{NNLO}"},
-                    square      = True,
-                    extraSpace  = 0.025,
-                    )
+    return objects
 
-            leg = create_leg( n_legentries = 4)
+def add_objects(path, objects):
+    """ Serve objects built in memory as if they were all that path holds, the file itself is never read """
 
-            # text label
+    _objects.setdefault(path, {}).update((obj.GetName(), obj) for obj in objects)
+    _complete.add(path)
 
-            text_label = {
-                    'HT_2': 'H_{T} / 2',
-                    'HT_4': 'H_{T} / 4',
-                    'm_ttx_2': r'm_{t\bar{t}} / 2',
-                    'mT_tx': r'm_{T, \bar{t}}',
-                    }[fname]
+def get_object(objects, name, path):
+    """ Object read by load_objects, with a clear error if the file does not hold it """
 
-            scale_label = rt.TLatex()
-            scale_label.SetNDC()
-            scale_label.SetTextAngle(0)
-            scale_label.SetTextColor(rt.kBlack)
-            scale_label.SetTextFont(52)
-            scale_label.SetTextAlign(11)
-            scale_label.SetTextSize(0.06)
+    obj = objects.get(name)
+    if not obj:
+        raise KeyError(f"{name} not found in {path}")
+
+    return obj
+
+# =============
 
-            scale_label.DrawLatex(0.3, 0.838, text_label)
+def plot_job(job, formats=("pdf",), booklet=None, page=None):
+    """ Render one PlotJob of the plan once, save it in every format, as a page of booklet and as the .root file page, return the written paths """
 
-            # ==== ratio pad
+    CMS.SetLumi(job.lumi, unit = None)
 
-            ratio_pad.cd()
-            ref_line = rt.TLine(0, 1, 800, 1)
-            CMS.cmsDrawLine(ref_line, lcolor=rt.kBlack, lstyle=rt.kDotted, lwidth=2)
+    # ==== Reading Data and predictions
 
-            # ==== Readingg and plotting Data
+    # the first job of a file reads what the whole plan needs from it, the following ones hit memory
+    objects = load_objects(job.infile, job.file_objects)
 
-            infile = rt.TFile.Open(indir + fname + ".root", "read")
+    data_graph = get_object(objects, job.data, job.infile) if job.data else None
+    data_norm = get_object(objects, job.data_ratio, job.infile) if job.data_ratio else None
 
-            # infile = rt.TFile.Open("./inputs/HEPData-ins1663958-v2-root.root", "read")
+    curves = []
+    for curve in job.curves:
 
-            # table_idx = {"t1": "Table 174", "t2": "Table 176"}[top]
-# 
-            # table = infile.Get(table_idx)
-            # data_graph = table.Get("Graph1D_y1")
-            # data_hist = table.Get("Hist1D_y1")
-            # data_hist.SetDirectory(0)
-
-            data_graph = infile.Get(f'{top}_data')
-            data_norm = infile.Get(f'{top}_normalized_data')
-
-            upper_pad.cd()
-            CMS.cmsDraw(h = data_graph, style = "", marker = 0, mcolor = rt.kBlack, fcolor = rt.kBlack, alpha = .5)
-            leg.AddEntry(data_graph, "Data", "lp")
-
-            ratio_pad.cd()
-            CMS.cmsDraw(h = data_norm, style = "", marker = 0, mcolor = rt.kBlack, fcolor = rt.kBlack, alpha = .5)
-
-
-            # infile.Close()
-
-            # =========== reading data
-
-            # plotting kwargs
-            plot_args = {
-                f"plot.pT_{top}..LO": {
-                    "mcolor": root_palette[0],
-                    "leg_entry": "LO",
-                },
-                f"plot.pT_{top}..NLO.QCD": {
-                    "mcolor": root_palette[1],
-                    "leg_entry": "NLO",
-                },
-                f"plot.pT_{top}..NNLO.QCD": {
-                    "mcolor": root_palette[2],
-                    "leg_entry": "NNLO",
-                },
-            }
-
-            # TODO: same distribution, at different orders, + data and ratio plot
-
-            hist_list = []
-
-            for dist in [
-                f"plot.pT_{top}..LO",
-                f"plot.pT_{top}..NLO.QCD",
-                f"plot.pT_{top}..NNLO.QCD",
-                ]:
-
-                upper_pad.cd()
-
-                graph = infile.Get(dist)
-                # hist = infile.Get(dist + "_TH1F")
-                # hist.SetDirectory(0)
-                # hist_list.append(hist)
-
-                # =========== plotting
-
-                graph_args = {
-                        "h": graph,
-                        "style": "",
-                        "marker": 0,
-                        # "msize": 10,
-                        "mcolor": plot_args[dist]["mcolor"],
-                        "fcolor": plot_args[dist]["mcolor"],
-                        # "fstyle": 3002,
-                        "alpha": .5,
-                        }
-                CMS.cmsDraw(**graph_args)
-
-                leg.AddEntry(graph, plot_args[dist]["leg_entry"], "lp")
-
-                ratio_pad.cd()
-
-                graph = infile.Get(dist + "_ratio")
-
-                graph_args = {
-                        "h": graph,
-                        "style": "",
-                        "marker": 0,
-                        # "msize": 10,
-                        "mcolor": plot_args[dist]["mcolor"],
-                        "fcolor": plot_args[dist]["mcolor"],
-                        # "fstyle": 3002,
-                        "alpha": .5,
-                        }
-
-                CMS.cmsDraw(**graph_args)
-
-            infile.Close()
-
-            # ===== ratio pad
-
-            # ratio_pad.cd()
-            # data_ratio = data_hist.Clone()
-            # LO_ratio = hist_list[0].Clone()
-            # NLO_ratio = hist_list[1].Clone()
-            # NNLO_hist = hist_list[2].Clone()
-# 
-            # data_ratio.Divide(NNLO_hist)
-            # LO_ratio.Divide(NNLO_hist)
-            # NLO_ratio.Divide(NNLO_hist)
-# 
-# 
-# 
-            # CMS.cmsDraw(h = data_ratio, style = "L", marker = 0, mcolor = rt.kBlack, fcolor = rt.kBlack, alpha = .5)
-            # CMS.cmsDraw(h = LO_ratio, style = "L", marker = 0, mcolor = rt.kBlue, fcolor = rt.kBlue, alpha = .5)
-            # CMS.cmsDraw(h = NLO_ratio, style = "L", marker = 0, mcolor = rt.kRed, fcolor = rt.kRed, alpha = .5)
-# 
-            # CMS.cmsDrawLine(line = data_ratio,  lcolor = rt.kBlack, lstyle=rt.kSolid)
-            # CMS.cmsDrawLine(line = LO_ratio,  lcolor = rt.kBlue)
-            # CMS.cmsDrawLine(line = NLO_ratio,  lcolor = rt.kRed)
- 
-            # ===== saving plot
-
-            if upper_pad:
-                upper_pad.cd()
-                CMS.fixOverlay()
-                ratio_pad.cd()
-                CMS.fixOverlay()
-            else:
-                canv.cd()
-                CMS.fixOverlay()
-
-            # ==== size of axis labels
-
-            # rt.gStyle.SetLabelSize(0.003, "XYZ")
-            # rt.gPad.RedrawAxis()
-            # CMS.FixXAxisPartition(canv, bins = [0, 40, 80, 120, 160, 200, 240, 280, 330, 380, 430, 500, 800])
-            # import pdb; pdb.set_trace()
-
-
-            CMS.SaveCanvas(canv, outdir+fname+"_" + top+".pdf")
+        graph = get_object(objects, curve.graph, job.infile)
+        ratio = objects.get(curve.ratio)
+
+        # files converted with --no-ratio-graphs hold the scale bands as histograms instead
+        if not ratio:
+            hists = [get_object(objects, name, job.infile) for name in curve.hists]
+            ratio = hist_band_ratio(hists, get_object(objects, job.reference_hist, job.infile), curve.ratio)
+
+        curves.append((curve, graph, ratio))
+
+    # =========== creating canvas and legend, ranges not fixed by the spec enclose everything drawn
+
+    upper_objects = [graph for _, graph, _ in curves] + [data_graph] * bool(data_graph)
+    ratio_objects = [ratio for _, _, ratio in curves] + [data_norm] * bool(data_norm)
+
+    canv, upper_pad, ratio_pad = create_canvas(
+            canvName        = "test_canvas",
+            ranges          = job.ranges,
+            logAxis         = job.log,
+            nameAxis        = job.axes,
+            square          = True,
+            extraSpace      = 0.025,
+            objects         = upper_objects,
+            ratio_objects   = ratio_objects,
+            )
+
+    leg = create_leg( n_legentries = len(job.curves) + bool(job.data))
+
+    # text label
+
+    scale_label = rt.TLatex()
+    scale_label.SetNDC()
+    scale_label.SetTextAngle(0)
+    scale_label.SetTextColor(rt.kBlack)
+    scale_label.SetTextFont(52)
+    scale_label.SetTextAlign(11)
+    scale_label.SetTextSize(0.06)
+
+    scale_label.DrawLatex(0.3, 0.838, job.scale_label)
+
+    # ==== plotting Data
+
+    if data_graph:
+        upper_pad.cd()
+        CMS.cmsDraw(h = data_graph, style = "", marker = 0, mcolor = rt.kBlack, fcolor = rt.kBlack, alpha = .5)
+        leg.AddEntry(data_graph, "Data", "lp")
+
+    if data_norm:
+        ratio_pad.cd()
+        CMS.cmsDraw(h = data_norm, style = "", marker = 0, mcolor = rt.kBlack, fcolor = rt.kBlack, alpha = .5)
+
+    # =========== predictions, same distribution at different orders
+
+    for curve, graph, ratio in curves:
+
+        color = rt.TColor.GetColor(curve.color)
+
+        upper_pad.cd()
+
+        # =========== plotting
+
+        graph_args = {
+                "h": graph,
+                "style": "",
+                "marker": 0,
+                # "msize": 10,
+                "mcolor": color,
+                "fcolor": color,
+                # "fstyle": 3002,
+                "alpha": .5,
+                }
+        CMS.cmsDraw(**graph_args)
+
+        leg.AddEntry(graph, curve.label, "lp")
+
+        ratio_pad.cd()
+
+        graph_args = {
+                "h": ratio,
+                "style": "",
+                "marker": 0,
+                # "msize": 10,
+                "mcolor": color,
+                "fcolor": color,
+                # "fstyle": 3002,
+                "alpha": .5,
+                }
+
+        CMS.cmsDraw(**graph_args)
+
+    # ===== saving plot
+
+    if upper_pad:
+        upper_pad.cd()
+        CMS.fixOverlay()
+        ratio_pad.cd()
+        CMS.fixOverlay()
+    else:
+        canv.cd()
+        CMS.fixOverlay()
+
+    # ==== size of axis labels
+
+    # rt.gStyle.SetLabelSize(0.003, "XYZ")
+    # rt.gPad.RedrawAxis()
+    # CMS.FixXAxisPartition(canv, bins = [0, 40, 80, 120, 160, 200, 240, 280, 330, 380, 430, 500, 800])
+
+
+    # ==== the individual files, then the booklet page: a job failing to save has no page yet and gets a placeholder
+
+    # the page of a booklet written by another process, not part of the outputs
+    if page:
+        CMS.SaveCanvas(canv, page, close=False)
+
+    paths = CMS.SaveCanvas(canv, job.outpath, close=False, formats=formats) if formats else []
+
+    if booklet:
+        CMS.AddToBooklet(canv, booklet, title=job.title, close=False)
+
+    canv.Close()
+
+    return paths
+
+# =============
+
+# a change to the plotting code itself, or to the modules it builds the plots with, also makes the saved plots outdated
+CODE_MODULES = ["cmsstyle", "dat2root", "matrix_io", "plot_spec", "rebin"]
+CODE_FILES = [os.path.abspath(__file__)] + [os.path.abspath(sys.modules[name].__file__) for name in CODE_MODULES]
+
+def object_arrays(obj):
+    """ Arrays holding the content of a graph or histogram read by load_objects """
+
+    if not obj:
+        return ()
+    if isinstance(obj, rt.TGraphAsymmErrors):
+        return graph_arrays(obj)
+    if isinstance(obj, rt.TH1):
+        ncells = obj.GetNcells()
+        edges = obj.GetXaxis().GetXbins()
+        arrays = [np.frombuffer(obj.GetArray(), dtype=np.float64, count=ncells), np.array([obj.GetXaxis().GetXmin(), obj.GetXaxis().GetXmax()])]
+        if edges.GetSize():
+            arrays.append(np.frombuffer(edges.GetArray(), dtype=np.float64, count=edges.GetSize()))
+        if obj.GetSumw2N():
+            arrays.append(np.frombuffer(obj.GetSumw2().GetArray(), dtype=np.float64, count=ncells))
+        return arrays
+
+    raise TypeError(f"cannot fingerprint {obj.GetName()} of type {obj.ClassName()}")
+
+def job_fingerprint(job, objects, formats):
+    """ sha1 of everything a plot depends on: its input objects, its entry of the spec, the cmsstyle settings and the code """
+
+    sha1 = hashlib.sha1()
+
+    for name in sorted(set(job_objects(job))):
+        obj = objects.get(name)
+        sha1.update(f"{name}:{obj.ClassName() if obj else None}".encode())
+        for arr in object_arrays(obj):
+            sha1.update(arr.tobytes())
+
+    # file_objects lists what the other jobs of the file read, it does not change this plot
+    params = {
+        "job": job._replace(file_objects=())._asdict(),
+        "formats": list(formats),
+        "style": CMS.GetSettings(),
+        "code": [file_fingerprint(path)["sha1"] for path in CODE_FILES],
+    }
+    sha1.update(json.dumps(params, sort_keys=True, default=list).encode())
+
+    return sha1.hexdigest()
+
+def run_job(job, formats=("pdf",), booklet=None, force=False, page=None):
+    """ Render a PlotJob unless its outputs were saved from the same fingerprint, return (written paths, skipped) """
+
+    # a booklet page needs the canvas, so there is nothing to skip
+    if booklet or page or not formats:
+        return plot_job(job, formats, booklet, page), False
+
+    # ==== the style is set as the render would set it, then fingerprinted with the inputs
+    CMS.SetLumi(job.lumi, unit = None)
+    CMS.SetExtraText(EXTRA_TEXT)
+
+    objects = load_objects(job.infile, job.file_objects)
+    fingerprint = job_fingerprint(job, objects, formats)
+
+    manifest_path = job.outpath + ".manifest.json"
+    manifest = load_manifest(manifest_path)
+
+    if not force and manifest.get("fingerprint") == fingerprint and all(os.path.exists(path) for path in manifest.get("outputs", [])):
+        return manifest["outputs"], True
+
+    paths = plot_job(job, formats)
+    save_manifest(manifest_path, {"fingerprint": fingerprint, "outputs": paths})
+
+    return paths, False
+
+def job_status(job, paths, skipped):
+    """ One line report of a job run by run_job """
+
+    if skipped:
+        return f"{job.title}: up to date ({', '.join(paths)})"
+    if not paths:
+        return f"{job.title}: booklet page only"
+    return f"{job.title}: wrote {', '.join(paths)}"
+
+def add_saved_canvas(booklet, rootpath, title):
+    """ Append the canvas saved in a .root file to a booklet """
+
+    infile = rt.TFile.Open(rootpath, "read")
+    canv = infile.GetListOfKeys().At(0).ReadObj()
+    canv.Draw()
+    CMS.AddToBooklet(canv, booklet, title)
+    infile.Close()
+
+def job_failed(job, error, booklet=None):
+    """ Report a job that raised, and keep its page in the booklet so that the index stays right; return its title """
+
+    print(f"{job.title}: failed with {error!r}", file=sys.stderr)
+    if booklet:
+        CMS.AddPlaceholderToBooklet(booklet, job.title, "plotting failed")
+
+    return job.title
+
+def main(spec=DEFAULT_SPEC, jobs=1, formats=("pdf",), booklet=None, index=False, force=False, scales=None):
+
+    # ======== I/O
+
+    # jobs of the same file follow each other, so that it is only read once per process
+    plan = build_plan(spec, scales)
+    titles = [job.title for job in plan]
+
+    for outdir in {os.path.dirname(job.outpath) for job in plan}:
+        os.makedirs(outdir or ".", exist_ok=True)
+
+    # ======== a booklet is written page by page, in the order of the jobs
+
+    if booklet:
+        CMS.OpenBooklet(booklet, titles if index else None)
+
+    failed = []
+    try:
+        if jobs <= 1:
+            for job in plan:
+                try:
+                    print(job_status(job, *run_job(job, formats, booklet, force)))
+                except Exception as error:
+                    failed.append(job_failed(job, error, booklet))
+
+        else:
+            # workers cannot share the booklet, they save their canvas in a temporary .root file and the pages are added here;
+            # each worker is a fresh ROOT session, in batch mode since it imports this module, the output path only depends on the job
+            context = multiprocessing.get_context("spawn")
+            with tempfile.TemporaryDirectory() as pagedir, ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+                pages = [os.path.join(pagedir, f"page{i}.root") if booklet else None for i in range(len(plan))]
+                futures = [(job, page, pool.submit(run_job, job, formats, force=force, page=page)) for job, page in zip(plan, pages)]
+
+                for job, page, future in futures:
+                    try:
+                        print(job_status(job, *future.result()))
+                    except Exception as error:
+                        failed.append(job_failed(job, error, booklet))
+                        continue
+
+                    if page:
+                        add_saved_canvas(booklet, page, job.title)
+
+        if failed:
+            raise SystemExit(f"plotting failed for {', '.join(failed)}")
+
+    finally:
+        if booklet:
+            CMS.CloseBooklet(booklet)
+            print(f"booklet: wrote {booklet}")
 
 if __name__ == "__main__":
     # CMS.setCMSStyle()
     # CMS.cmsStyle.SetLabelSize(0.003, "XYZ")
-    main()
 
+    parser = argparse.ArgumentParser(description="Plot the converted MATRIX predictions against data")
+    parser.add_argument("-s", "--spec", help=".json or .yaml plot spec (default: the built-in one, see plot_spec.py)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("-f", "--formats", nargs="*", default=["pdf"], help="output formats written from a single render, e.g. pdf png svg root C (none: booklet only)")
+    parser.add_argument("-b", "--booklet", help="also stream every plot into this multi-page PDF")
+    parser.add_argument("--index", action="store_true", help="start the booklet with an index page")
+    parser.add_argument("--force", action="store_true", help="render every plot, even those saved from the same inputs, spec and style")
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec) if args.spec else DEFAULT_SPEC
+
+    main(spec=spec, jobs=args.jobs, formats=args.formats, booklet=args.booklet, index=args.index, force=args.force)
@@ -0,0 +1,72 @@
+import argparse
+import os
+
+import numpy as np
+
+from matrix_io import FLAT_ORDERS, RATE_DTYPE, available_scales, rate_from_table, read_result_summary, read_table, run_order
+
+# ===========
+# Total rates of the flattened inputs (plot.total_rate..<order>.dat, one per scale choice) and of
+# the raw runs (summary/result_summary.dat), as RATE_DTYPE arrays. Rates of several scale choices are
+# a [scale, order] array, so K-factors and normalized distributions are single broadcasts.
+
+def scale_rates(scales=None, orders=FLAT_ORDERS, indir="./inputs/{scale}/"):
+    """ Total rates of every scale choice and order, as a [scale, order] RATE_DTYPE array """
+
+    scales = scales or available_scales(indir)
+
+    rates = np.empty((len(scales), len(orders)), dtype=RATE_DTYPE)
+    for i, scale in enumerate(scales):
+        for j, order in enumerate(orders):
+            rates[i, j] = rate_from_table(read_table(indir.format(scale=scale) + f"plot.total_rate..{order}.dat"), scale, order)
+
+    return rates
+
+def run_rates(rundir):
+    """ Total rates of a raw MATRIX run directory, from its result summary """
+
+    return read_result_summary(os.path.join(rundir, "summary", "result_summary.dat"))
+
+def k_factors(rates, reference=0):
+    """ Rates of a [scale, order] array divided by those of the reference order (default: the lowest) """
+
+    values = rates["rate"]
+
+    return values / values[..., reference:reference+1]
+
+def normalized_grid(grid, rates):
+    """ ScaleGrid divided by the total rates of the same scales and orders, i.e. 1/sigma dsigma/dX """
+
+    if list(rates["run"][:, 0]) != grid.scales or list(rates["order"][0]) != [run_order(order) for order in grid.orders]:
+        raise ValueError(f"rates of {list(rates['run'][:, 0])} x {list(rates['order'][0])} do not match {grid.name} for {grid.scales} x {grid.orders}")
+
+    # the band is divided by the central rate: the individual scale variations are not in the files,
+    # so their cancellation between the distribution and the rate cannot be reproduced
+    return grid._replace(name=grid.name + "_normalized", values=grid.values / rates["rate"][None, :, :, None])
+
+# ===========
+
+def print_rates(rates, label):
+    """ Print a RATE_DTYPE array, one rate per line """
+
+    print(label)
+    for row in rates.reshape(-1):
+        pdf = f" {row['pdf']}" if row["pdf"] else ""
+        print(f"    {row['run']:<12} {row['order']:<10} {row['rate']:10.2f} +/- {row['error']:6.2f} pb  {row['scale_up']:+7.1%} {row['scale_down']:+7.1%}{pdf}")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Total rates and K-factors of the flattened inputs and of raw MATRIX runs")
+    parser.add_argument("scales", nargs="*", help="scale choices to read (default: every one with an input directory)")
+    parser.add_argument("-r", "--runs", nargs="+", default=[], help="raw MATRIX run directories, e.g. inputs/run_*")
+    args = parser.parse_args()
+
+    rates = scale_rates(args.scales)
+    print_rates(rates, "total rates")
+
+    print("K-factors")
+    for scale, k in zip(rates["run"][:, 0], k_factors(rates)):
+        print(f"    {scale:<12} " + "  ".join(f"{order} {value:.3f}" for order, value in zip(rates["order"][0], k)))
+
+    for rundir in args.runs:
+        print_rates(run_rates(rundir), rundir)
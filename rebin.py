@@ -0,0 +1,128 @@
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+from matrix_io import DistributionTable
+
+# ===========
+# MATRIX distributions are differential, so merging bins sums value * width over the source bins of
+# each target bin and divides by the target width. The source bins merged into each target bin are
+# contiguous: the merge is stored as the start of each group and applied with np.add.reduceat on the
+# last axis, i.e. one sparse matrix product for any number of stacked distributions.
+
+OVERFLOW_POLICIES = ("drop", "raise", "last")
+
+class Rebinner(NamedTuple):
+    """ Merge of a source binning into a target binning whose edges are all source edges """
+
+    source_edges: np.ndarray
+    target_edges: np.ndarray
+    first: int                  # first source bin kept
+    stop: int                   # source bins kept are [first, stop)
+    starts: np.ndarray          # first source bin of each target bin, relative to first
+    weights: np.ndarray         # source bin width / target bin width, for the kept source bins
+
+    @property
+    def identity(self):
+        """ Whether each target bin is a single source bin, the values are then only sliced """
+
+        return len(self.starts) == self.stop - self.first
+
+    @property
+    def matrix(self):
+        """ Dense [target, source] merge matrix, mostly for inspection """
+
+        matrix = np.zeros((len(self.target_edges) - 1, len(self.source_edges) - 1))
+        groups = np.repeat(np.arange(len(self.starts)), np.diff(np.append(self.starts, self.stop - self.first)))
+        matrix[groups, np.arange(self.first, self.stop)] = self.weights
+
+        return matrix
+
+    def values(self, values):
+        """ Rebin values, the last axis being the source bins """
+
+        kept = np.asarray(values)[..., self.first:self.stop]
+        if self.identity:
+            return kept
+
+        return np.add.reduceat(kept * self.weights, self.starts, axis=-1)
+
+    def errors(self, errors):
+        """ Rebin uncorrelated errors, summed in quadrature """
+
+        kept = np.asarray(errors)[..., self.first:self.stop]
+        if self.identity:
+            return kept
+
+        return np.sqrt(np.add.reduceat((kept * self.weights) ** 2, self.starts, axis=-1))
+
+
+@lru_cache(maxsize=None)
+def _rebinner(source_edges, target_edges, overflow):
+
+    source = np.array(source_edges)
+    target = np.array(target_edges)
+
+    if len(target) < 2 or np.any(np.diff(target) <= 0):
+        raise ValueError(f"target edges must be increasing: {target}")
+
+    # each target edge is matched to the nearest source edge within a tolerance, on either side:
+    # edges computed as x -/+ ex, like those of HEPData, carry float noise
+    tol = 1.e-6 * np.diff(source).min()
+    index = np.searchsorted(source, target - tol)
+    if np.any(index >= len(source)) or np.any(np.diff(index) <= 0) or not np.allclose(source[np.minimum(index, len(source) - 1)], target, rtol=0., atol=tol):
+        raise ValueError(f"target edges {target} are not all source edges {source}, bins cannot be split")
+
+    # from here on the target edges are exactly the matched source edges
+    target = source[index]
+
+    first, stop = int(index[0]), int(index[-1])
+
+    # ==== source bins outside of the target range
+
+    if overflow == "raise" and (first > 0 or stop < len(source) - 1):
+        raise ValueError(f"source binning [{source[0]}, {source[-1]}] extends beyond the target binning [{target[0]}, {target[-1]}]")
+
+    if overflow == "last":
+        # under- and overflow are merged into the first and last target bins, which then keep their width
+        index = index.copy()
+        index[0], index[-1] = 0, len(source) - 1
+        first, stop = 0, len(source) - 1
+
+    widths = np.diff(source)[first:stop]
+    target_widths = np.diff(target)
+    groups = np.repeat(np.arange(len(target_widths)), np.diff(index))
+
+    starts = index[:-1] - first
+    weights = widths / target_widths[groups]
+
+    rebinner = Rebinner(source, target, first, stop, starts, weights)
+    for arr in rebinner[:2] + rebinner[4:]:
+        arr.flags.writeable = False
+
+    return rebinner
+
+def get_rebinner(source_edges, target_edges, overflow="drop"):
+    """ Rebinner from source to target edges, cached per (source, target, overflow); source bins outside of the target range are dropped ('drop'), refused ('raise') or merged into the first and 'last' target bins """
+
+    if overflow not in OVERFLOW_POLICIES:
+        raise ValueError(f"unknown overflow policy '{overflow}', expected one of {OVERFLOW_POLICIES}")
+
+    return _rebinner(tuple(np.asarray(source_edges, dtype=np.float64)), tuple(np.asarray(target_edges, dtype=np.float64)), overflow)
+
+def rebin_table(table, target_edges, overflow="drop"):
+    """ DistributionTable rebinned to target_edges: values merged linearly, MC errors in quadrature """
+
+    rebinner = get_rebinner(table.edges, target_edges, overflow)
+
+    # min and max are each a scale variation, correlated between neighbouring bins, so they are merged like the central value
+    return DistributionTable(
+        rebinner.target_edges,
+        rebinner.values(table.central),
+        rebinner.errors(table.central_err),
+        rebinner.values(table.min),
+        rebinner.errors(table.min_err),
+        rebinner.values(table.max),
+        rebinner.errors(table.max_err),
+        )